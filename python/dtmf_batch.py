@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.io import wavfile
+
+from task4 import DTMFStreamDecoder
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+# Size of the frames fed to the stream decoder, s
+FRAME_DURATION = 0.01
+
+
+def list_files(source):
+    """
+    Collect the WAV files to decode.
+
+    `source` is either a directory, scanned for `*.wav` files, or a manifest
+    with one path per line, relative paths being resolved against the manifest directory.
+    """
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith('.wav'))
+
+    base = os.path.dirname(source)
+    with open(source) as manifest:
+        return [os.path.join(base, line.strip()) for line in manifest if line.strip()]
+
+
+def to_float(samples):
+    """
+    Convert PCM samples to float in [-1, 1] and mix multichannel audio down to mono.
+    """
+    if samples.dtype == np.uint8:
+        samples = (samples.astype(np.float32) - 128) / 128
+    elif np.issubdtype(samples.dtype, np.integer):
+        samples = samples.astype(np.float32) / np.iinfo(samples.dtype).max
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    return samples
+
+
+def read_frames(path):
+    """
+    Return the sample rate of a WAV file and an iterator over its mono float frames of `FRAME_DURATION`.
+
+    The file is memory-mapped when scipy can do so. Files it cannot map, such as 24-bit
+    PCM, are decoded frame by frame with `soundfile`, or read whole when it is not installed.
+    """
+    try:
+        sample_rate, samples = wavfile.read(path, mmap=True)
+    except ValueError:
+        if soundfile is not None:
+            sample_rate = soundfile.info(path).samplerate
+            frame_size = max(1, int(FRAME_DURATION * sample_rate))
+            blocks = soundfile.blocks(path, blocksize=frame_size, dtype='float32')
+            return sample_rate, (to_float(block) for block in blocks)
+        sample_rate, samples = wavfile.read(path)
+
+    frame_size = max(1, int(FRAME_DURATION * sample_rate))
+    return sample_rate, (to_float(samples[start:start + frame_size]) for start in range(0, len(samples), frame_size))
+
+
+def decode_file(path):
+    """
+    Decode the DTMF digits of one WAV file into a JSON-serializable result.
+
+    The file is read by `read_frames` and fed to `DTMFStreamDecoder` frame by frame,
+    so memory does not grow with the clip length. The confidence of the file
+    is the lowest confidence among its digits. A file that cannot be read or
+    decoded gives an error record instead.
+    """
+    try:
+        sample_rate, frames = read_frames(path)
+        decoder = DTMFStreamDecoder(sample_rate)
+        events = []
+        for frame in frames:
+            events += decoder.process(frame)
+    except (OSError, ValueError, RuntimeError) as error:
+        return {'file': path, 'error': str(error)}
+
+    return {
+        'file': path,
+        'digits': ''.join(event.digit for event in events),
+        'events': [{'digit': event.digit, 'start': event.start, 'confidence': event.confidence} for event in events],
+        'confidence': min((event.confidence for event in events), default=0.0),
+    }
+
+
+def decode_batch(paths, output, workers=None, chunksize=16):
+    """
+    Decode `paths` across a process pool and write one JSON line per file to `output`, in input order.
+
+    Returns the number of files written.
+    """
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(decode_file, paths, chunksize=chunksize):
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def benchmark_throughput(paths, worker_counts=None, chunksize=16):
+    """
+    Print decoding throughput in files/sec for an increasing number of worker processes.
+    """
+    if worker_counts is None:
+        cpu_count = os.cpu_count() or 1
+        worker_counts = sorted({2 ** i for i in range(cpu_count.bit_length())} | {cpu_count})
+
+    print('workers,files,seconds,files_per_sec')
+    with open(os.devnull, 'w') as output:
+        for workers in worker_counts:
+            start = time.perf_counter()
+            count = decode_batch(paths, output, workers, chunksize)
+            elapsed = time.perf_counter() - start
+            print(f'{workers},{count},{elapsed:.3f},{count / elapsed:.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode DTMF digits from many WAV files.')
+    parser.add_argument('source', help='directory with WAV files or a manifest with one path per line')
+    parser.add_argument('-o', '--output', help='JSON lines output file, stdout by default')
+    parser.add_argument('-w', '--workers', type=int, help='number of worker processes, CPU count by default')
+    parser.add_argument('-c', '--chunksize', type=int, default=16, help='files submitted to a worker at once')
+    parser.add_argument('--benchmark', action='store_true', help='report files/sec as the worker count grows')
+    args = parser.parse_args(argv)
+
+    paths = list_files(args.source)
+    if args.benchmark:
+        benchmark_throughput(paths, chunksize=args.chunksize)
+        return
+
+    if args.output is None:
+        decode_batch(paths, sys.stdout, args.workers, args.chunksize)
+        return
+
+    with open(args.output, 'w') as output:
+        decode_batch(paths, output, args.workers, args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
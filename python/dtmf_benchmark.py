@@ -0,0 +1,113 @@
+import argparse
+import csv
+import itertools
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter as timer
+
+import numpy as np
+
+from task4 import DTMF_HIGH_FREQS, DTMF_LOW_FREQS, DTMF_TABLE, DTMFStreamDecoder, add_noise, generate_signal
+
+# Silence around every tone, s
+PAD_DURATION = 0.1
+
+FIELDS = ['sample_rate', 'duration', 'snr_db', 'trials', 'accuracy', 'false_positive_rate', 'single_tone_rate',
+          'us_per_clip']
+
+
+def run_trials(sample_rate, duration, snr_db, trials, seed):
+    """
+    Decode `trials` noisy single-digit clips, as many noise-only clips and as many clips of a lone
+    row or column tone for one configuration.
+
+    Tones start after `PAD_DURATION` plus a random part of a detection block, so every
+    alignment of the onset with the decoder blocks is tried, not only the most favourable one.
+    The SNR is the tone power over the noise power in dB. A clip is accurate when exactly its
+    digit is reported; the false-positive rate counts wrong, repeated and noise-only events per clip,
+    and `single_tone_rate` the events per lone-tone clip, which should all be rejected.
+    `us_per_clip` is the mean time to decode one single-digit clip, padding included.
+    """
+    rng = np.random.default_rng(seed)
+    digits = list(DTMF_TABLE)
+    single_freqs = DTMF_LOW_FREQS + DTMF_HIGH_FREQS
+    pad = np.zeros(int(PAD_DURATION * sample_rate))
+    tone_time = np.arange(int(duration * sample_rate)) / sample_rate
+    block_size = DTMFStreamDecoder(sample_rate).block_size
+
+    correct = 0
+    false_positives = 0
+    single_tone_events = 0
+    decode_time = 0.0
+    for _ in range(trials):
+        digit = digits[rng.integers(len(digits))]
+        tone = generate_signal(DTMF_TABLE[digit], tone_time)
+        scale = np.sqrt(np.mean(tone ** 2) / 10 ** (snr_db / 10))
+        onset = np.zeros(rng.integers(block_size))
+        clip = add_noise(np.concatenate((pad, onset, tone, pad)), scale, rng)
+
+        start = timer()
+        decoded = [event.digit for event in DTMFStreamDecoder(sample_rate).process(clip)]
+        decode_time += timer() - start
+
+        correct += decoded == [digit]
+        false_positives += len(decoded) - (digit in decoded)
+        false_positives += len(DTMFStreamDecoder(sample_rate).process(add_noise(np.zeros(len(clip)), scale, rng)))
+
+        single_tone = np.sin(2 * np.pi * single_freqs[rng.integers(len(single_freqs))] * tone_time)
+        onset = np.zeros(rng.integers(block_size))
+        single_clip = add_noise(np.concatenate((pad, onset, single_tone, pad)), scale, rng)
+        single_tone_events += len(DTMFStreamDecoder(sample_rate).process(single_clip))
+
+    return {
+        'sample_rate': sample_rate,
+        'duration': duration,
+        'snr_db': snr_db,
+        'trials': trials,
+        'accuracy': correct / trials,
+        'false_positive_rate': false_positives / (2 * trials),
+        'single_tone_rate': single_tone_events / trials,
+        'us_per_clip': decode_time / trials * 1e6,
+    }
+
+
+def run_trials_job(job):
+    return run_trials(*job)
+
+
+def run_benchmark(snrs, durations, sample_rates, trials=200, seed=0, workers=None):
+    """
+    Run every `(sample_rate, duration, snr)` configuration across a process pool, with a fixed seed per configuration.
+    """
+    configurations = itertools.product(sample_rates, durations, snrs)
+    jobs = [(sample_rate, duration, snr_db, trials, seed + i)
+            for i, (sample_rate, duration, snr_db) in enumerate(configurations)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_trials_job, jobs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure DTMF detection accuracy and speed under noise.')
+    parser.add_argument('--snr', type=float, nargs='+', default=[-10, -5, 0, 5, 10, 20], help='SNR values, dB')
+    parser.add_argument('--durations', type=float, nargs='+', default=[0.03, 0.04, 0.06, 0.1], help='tone lengths, s')
+    parser.add_argument('--sample-rates', type=int, nargs='+', default=[8000, 16000, 44100])
+    parser.add_argument('--trials', type=int, default=200, help='clips per configuration')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-w', '--workers', type=int, help='number of worker processes, CPU count by default')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    args = parser.parse_args(argv)
+
+    rows = run_benchmark(args.snr, args.durations, args.sample_rates, args.trials, args.seed, args.workers)
+    if args.format == 'json':
+        for row in rows:
+            print(json.dumps(row))
+        return
+
+    writer = csv.DictWriter(sys.stdout, FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import bisect
+import json
+from time import perf_counter as timer
+
+import numpy as np
+
+from task4 import DTMF_TABLE, generate_signal
+
+# Tone and pause lengths of the generated digit sequences, s
+TONE_DURATION = 0.06
+GAP_DURATION = 0.06
+
+
+def build_stream(digits, sample_rate, repeat=1):
+    """
+    16-bit PCM bytes of `digits` repeated `repeat` times, every tone followed by a pause.
+    """
+    tone_time = np.arange(int(TONE_DURATION * sample_rate)) / sample_rate
+    gap = np.zeros(int(GAP_DURATION * sample_rate))
+    parts = [gap]
+    for digit in digits * repeat:
+        parts += [generate_signal(DTMF_TABLE[digit], tone_time), gap]
+    return (np.concatenate(parts) / 2 * 32767).astype('<i2').tobytes()
+
+
+async def run_stream(connect, payload, sample_rate, chunk_duration=0.02, realtime=False):
+    """
+    Send one stream in chunks of `chunk_duration` seconds and collect the server events.
+
+    The latency of an event is the time from sending the chunk holding its detection sample
+    to receiving the event. With `realtime` the chunks are paced at the audio rate.
+    """
+    reader, writer = await connect()
+    writer.write((json.dumps({'sample_rate': sample_rate, 'dtype': '<i2'}) + '\n').encode())
+
+    chunk_bytes = int(chunk_duration * sample_rate) * 2
+    sent_positions, sent_times = [], []
+    latencies = []
+
+    async def receive():
+        async for line in reader:
+            message = json.loads(line)
+            if 'position' in message:
+                index = min(bisect.bisect_left(sent_positions, message['position']), len(sent_times) - 1)
+                latencies.append(timer() - sent_times[index])
+            elif 'end' in message:
+                return message
+
+    receiver = asyncio.ensure_future(receive())
+    start = timer()
+    for offset in range(0, len(payload), chunk_bytes):
+        chunk = payload[offset:offset + chunk_bytes]
+        if realtime:
+            await asyncio.sleep(max(0.0, start + offset / 2 / sample_rate - timer()))
+        sent_positions.append((offset + len(chunk)) // 2)
+        sent_times.append(timer())
+        writer.write(chunk)
+        await writer.drain()
+    writer.write_eof()
+
+    summary = await receiver
+    writer.close()
+    return summary, latencies
+
+
+async def run_load_test(connect, streams, digits, sample_rate, repeat, chunk_duration, realtime):
+    payload = build_stream(digits, sample_rate, repeat)
+    start = timer()
+    results = await asyncio.gather(*[run_stream(connect, payload, sample_rate, chunk_duration, realtime)
+                                     for _ in range(streams)])
+    return results, timer() - start, len(payload) // 2 / sample_rate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test a dtmf_server with concurrent streams.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--unix', help='connect to a Unix socket at this path instead of TCP')
+    parser.add_argument('-n', '--streams', type=int, default=64, help='concurrent streams')
+    parser.add_argument('--digits', default='0123456789*#ABCD')
+    parser.add_argument('--repeat', type=int, default=5, help='times every stream sends the digits')
+    parser.add_argument('--sample-rate', type=int, default=8000)
+    parser.add_argument('--chunk', type=float, default=0.02, help='chunk length, s')
+    parser.add_argument('--realtime', action='store_true', help='send at the audio rate instead of at full speed')
+    parser.add_argument('--cores', type=int, help='cores used by the server, the workers it reports by default')
+    args = parser.parse_args(argv)
+
+    if args.unix is not None:
+        connect = lambda: asyncio.open_unix_connection(args.unix)
+    else:
+        connect = lambda: asyncio.open_connection(args.host, args.port)
+
+    results, elapsed, stream_duration = asyncio.run(run_load_test(
+        connect, args.streams, args.digits, args.sample_rate, args.repeat, args.chunk, args.realtime))
+
+    latencies = np.concatenate([latency for _, latency in results]) * 1e3
+    expected = args.digits * args.repeat
+    realtime_streams = args.streams * stream_duration / elapsed
+    cores = args.cores or results[0][0].get('workers')
+    print(json.dumps({
+        'streams': args.streams,
+        'seconds': round(elapsed, 3),
+        'audio_seconds': round(args.streams * stream_duration, 3),
+        'cores': cores,
+        'realtime_streams_per_core': round(realtime_streams / cores, 1) if cores else None,
+        'events': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+        'accuracy': sum(summary['digits'] == expected for summary, _ in results) / args.streams,
+    }))
+
+
+if __name__ == '__main__':
+    main()
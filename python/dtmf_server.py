@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from dtmf_batch import to_float
+from task4 import DTMFStreamDecoder
+
+# Largest read from a stream decoded at once, bytes; streams waiting for a worker read bigger chunks
+READ_SIZE = 32768
+# Sample rates accepted in a stream header, Hz
+MIN_SAMPLE_RATE = 4000
+MAX_SAMPLE_RATE = 192000
+
+
+def ignore_interrupt():
+    # Ctrl+C reaches the whole process group; only the server process handles it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def decode_chunk(decoder, samples):
+    """
+    Feed a chunk to `decoder` in a worker and return the updated decoder with the completed events.
+    """
+    events = decoder.process(samples)
+    return decoder, events
+
+
+class DTMFServer:
+    """
+    Asyncio server decoding concurrent PCM streams into DTMF digit events.
+
+    A client sends one JSON header line, e.g. `{"sample_rate": 8000, "dtype": "<i2"}`, then
+    raw mono samples until it closes its side of the connection. Every chunk read is decoded
+    by a `DTMFStreamDecoder` on `executor` and the digits are pushed back as JSON lines with
+    `position`, the sample at which the digit was detected. The last line sums up the stream.
+
+    The sample rate must be within `MIN_SAMPLE_RATE` and `MAX_SAMPLE_RATE` and the dtype an
+    integer or float one, otherwise the stream is answered with an `invalid header` error.
+
+    At most `max_pending` chunks are decoded at once; streams waiting for a worker stop
+    reading their socket, so the clients are slowed down by the transport flow control.
+    The summary line reports `workers`, the decoding workers of `executor`, if given.
+
+    Example of usage :
+
+        server = DTMFServer(ProcessPoolExecutor(4), max_pending=8)
+        asyncio.run(server.serve(port=9000))
+    """
+
+    def __init__(self, executor, max_pending, workers=None):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.workers = workers
+        self.pending = None
+
+    async def send(self, writer, message):
+        writer.write((json.dumps(message) + '\n').encode())
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            header = json.loads(await reader.readline())
+            dtype = np.dtype(header.get('dtype', '<i2'))
+            if dtype.kind not in 'iuf':
+                raise ValueError(f'unsupported dtype {dtype}')
+            sample_rate = int(header['sample_rate'])
+            if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+                raise ValueError(f'sample rate {sample_rate} outside {MIN_SAMPLE_RATE}-{MAX_SAMPLE_RATE} Hz')
+            decoder = DTMFStreamDecoder(sample_rate)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            await self.send(writer, {'error': f'invalid header: {error}'})
+            writer.close()
+            return
+
+        loop = asyncio.get_running_loop()
+        received, leftover, digits = 0, b'', []
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                data = leftover + data
+                usable = len(data) - len(data) % dtype.itemsize
+                leftover = data[usable:]
+                samples = to_float(np.frombuffer(data[:usable], dtype=dtype))
+
+                async with self.pending:
+                    decoder, events = await loop.run_in_executor(self.executor, decode_chunk, decoder, samples)
+                received += len(samples)
+
+                for event in events:
+                    digits.append(event.digit)
+                    position = int(round(event.start * decoder.sample_rate)) + decoder.detection_delay
+                    await self.send(writer, {'digit': event.digit, 'start': event.start,
+                                             'confidence': event.confidence, 'position': position})
+
+            await self.send(writer, {'end': True, 'digits': ''.join(digits), 'samples': received,
+                                     'workers': self.workers})
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def serve(self, host='127.0.0.1', port=None, unix_path=None):
+        """
+        Accept streams on a Unix socket at `unix_path`, or on TCP `host:port`, until cancelled.
+        """
+        self.pending = asyncio.Semaphore(self.max_pending)
+        if unix_path is not None:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode DTMF digits from concurrent PCM streams.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--unix', help='listen on a Unix socket at this path instead of TCP')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='decoding workers')
+    parser.add_argument('--max-pending', type=int, help='chunks decoded at once, twice the workers by default')
+    parser.add_argument('--threads', action='store_true', help='decode on threads instead of processes')
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+    else:
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=ignore_interrupt)
+    server = DTMFServer(executor, args.max_pending or 2 * args.workers, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported on the first attribute access.
+    """
+
+    def __getattr__(self, name):
+        return getattr(importlib.import_module(self.__name__), name)
+
+
+def lazy_import(name):
+    """
+    Module `name`, imported only when one of its attributes is first used.
+
+    Unlike `importlib.util.LazyLoader`, parent packages are deferred as well, so
+    `lazy_import('matplotlib.pyplot')` does not import `matplotlib` either.
+
+    Example of usage :
+
+        plt = lazy_import('matplotlib.pyplot')
+    """
+    return LazyModule(name)
@@ -0,0 +1,243 @@
+"""
+Command line entry point of the signal processing scripts.
+
+Run from this directory as `python -m media <command>`. Every command imports only the
+modules it needs, e.g. `dtmf-decode` loads neither matplotlib nor librosa, and nothing
+is plotted or loaded when the task modules are imported.
+
+Example of usage :
+
+    python -m media modulate --kind fm -o fm.wav
+    python -m media filter lump.wav filtered.wav --ftype cheby1 --btype bandstop --lowcut 100 --highcut 1000
+    python -m media importtime --output importtime.json
+    python -m media check
+    python -m media serve --unix /tmp/media.sock --filter cheby1 bandstop 100 1000 4 --filter-output ./filtered
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+# Modules whose import time is reported by `importtime`
+IMPORT_TIME_MODULES = ['spectral', 'plotting', 'task2', 'task3', 'task4', 'task6', 'task7', 'dtmf_batch', 'media']
+
+# Anti-aliasing filter orders of `task7.get_processed_signals`
+RESAMPLE_ORDERS = {'fir': 21, 'iir': 1}
+
+
+def load_signal(path, sample_rate=None):
+    """
+    Read a mono float signal from a `.npy` file sampled at `sample_rate`, or from any `task6.open_audio` file.
+    """
+    if path.endswith('.npy'):
+        return np.load(path), sample_rate
+
+    import task6
+    source = task6.open_audio(path)
+    return source.read(), source.sample_rate
+
+
+def save_signal(path, blocks, sample_rate):
+    """
+    Write consecutive signal blocks to a `.npy` file, or to a WAV file as they arrive.
+    """
+    if path.endswith('.npy'):
+        np.save(path, np.concatenate(list(blocks)))
+        return
+
+    import task6
+    task6.write_blocks(blocks, path, sample_rate)
+
+
+def modulate(args):
+    import task2
+    time = np.arange(0, args.duration, 1. / args.sample_rate)
+    generate_bank = task2.generate_am_bank if args.kind == 'am' else task2.generate_fm_bank
+    sig = generate_bank(args.amp_c, args.amp_s, args.km, args.carrier, args.frequency, time=time)[0]
+    if args.noise:
+        sig = task2.add_noise(sig)
+    save_signal(args.output, [sig], args.sample_rate)
+
+
+def convolve(args):
+    import task3
+    kernel, _ = load_signal(args.kernel, args.sample_rate)
+    if args.method in ('overlap-add', 'overlap-save'):
+        convolve_blocks = task3.overlap_add_convolve if args.method == 'overlap-add' else task3.overlap_save_convolve
+        if args.signal.endswith('.npy'):
+            sample_rate, blocks = args.sample_rate, [np.load(args.signal)]
+        else:
+            import task6
+            sample_rate, blocks = task6.read_blocks(args.signal, args.block_size)
+        save_signal(args.output, convolve_blocks(blocks, kernel, args.block_size), sample_rate)
+        return
+
+    sig, sample_rate = load_signal(args.signal, args.sample_rate)
+    convolved = task3.circle_convolve(sig, kernel) if args.method == 'circular' else task3.convolve(sig, kernel)
+    save_signal(args.output, [convolved], sample_rate)
+
+
+def dtmf_decode(args):
+    import dtmf_batch
+    paths = dtmf_batch.list_files(args.source)
+    if args.output is None:
+        dtmf_batch.decode_batch(paths, sys.stdout, args.workers, args.chunksize)
+        return
+
+    with open(args.output, 'w') as output:
+        dtmf_batch.decode_batch(paths, output, args.workers, args.chunksize)
+
+
+def filter_file(args):
+    import task6
+    task6.stream_filter_file(args.input, args.output, args.ftype, args.btype, args.lowcut, args.highcut, args.order,
+                             args.block_size, args.spectrogram)
+
+
+def resample(args):
+    import task7
+    sig, sample_rate = load_signal(args.input, args.sample_rate)
+    decimated_sig, resampled_sig = task7.process_signals(sig, args.factor, RESAMPLE_ORDERS[args.ftype], args.ftype,
+                                                         args.mode)
+    if args.restore:
+        save_signal(args.output, [resampled_sig], sample_rate)
+    else:
+        save_signal(args.output, [decimated_sig], sample_rate // args.factor)
+
+
+def serve(args):
+    import service
+    filters = [(ftype, btype, float(lowcut), float(highcut), int(order))
+               for ftype, btype, lowcut, highcut, order in args.filter or []]
+    service.serve(filters, args.filter_output, args.sos_cache, args.unix, args.port)
+
+
+def check(args):
+    """
+    Check the fast implementations against their reference ones; raises `ValueError` on a mismatch.
+    """
+    import task3
+    import task4
+    task4.check_goertzel()
+    print('goertzel_vectorized matches goertzel')
+    task4.check_stream_decoder()
+    print('DTMFStreamDecoder enforces the minimum tone duration')
+    task3.check_correlation()
+    print('sum_of_correlation_fft matches sum_of_correlation_direct')
+
+
+def import_time(module):
+    """
+    Cumulative time in seconds of importing `module` in a fresh interpreter, as reported by `-X importtime`.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                            text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    return None
+
+
+def benchmark_imports(args):
+    """
+    Print the best of `repeat` import times of every `IMPORT_TIME_MODULES` module next to a saved baseline.
+    """
+    timings = {module: min(import_time(module) for _ in range(args.repeat)) for module in IMPORT_TIME_MODULES}
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    print('module,seconds,baseline_seconds')
+    for module, seconds in timings.items():
+        previous = baseline.get(module)
+        print(f'{module},{seconds:.3f},{"" if previous is None else f"{previous:.3f}"}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(timings, file, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m media', description='Signal processing tools of the task scripts.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('modulate', help='generate an AM or FM signal')
+    command.add_argument('-o', '--output', required=True, help='.wav or .npy file')
+    command.add_argument('--kind', choices=['am', 'fm'], default='am')
+    command.add_argument('--carrier', type=float, default=2000, help='carrier frequency, Hz')
+    command.add_argument('--frequency', type=float, default=150, help='modulating signal frequency, Hz')
+    command.add_argument('--amp-c', type=float, default=10, help='carrier magnitude')
+    command.add_argument('--amp-s', type=float, default=2, help='modulating signal magnitude')
+    command.add_argument('--km', type=float, default=1.0, help='modulation coefficient')
+    command.add_argument('--duration', type=float, default=0.0075, help='signal length, s')
+    command.add_argument('--sample-rate', type=int, default=40000)
+    command.add_argument('--noise', action='store_true', help='add gaussian noise')
+    command.set_defaults(run=modulate)
+
+    command = commands.add_parser('convolve', help='convolve a signal with a kernel')
+    command.add_argument('signal', help='audio or .npy file')
+    command.add_argument('kernel', help='audio or .npy file')
+    command.add_argument('-o', '--output', required=True, help='.wav or .npy file')
+    command.add_argument('--method', choices=['direct', 'circular', 'overlap-add', 'overlap-save'], default='direct')
+    command.add_argument('--block-size', type=int, default=4096, help='block length of the overlap methods')
+    command.add_argument('--sample-rate', type=int, default=44100, help='sample rate of .npy inputs')
+    command.set_defaults(run=convolve)
+
+    command = commands.add_parser('dtmf-decode', help='decode DTMF digits from WAV files')
+    command.add_argument('source', help='directory with WAV files or a manifest with one path per line')
+    command.add_argument('-o', '--output', help='JSON lines output file, stdout by default')
+    command.add_argument('-w', '--workers', type=int, help='number of worker processes, CPU count by default')
+    command.add_argument('-c', '--chunksize', type=int, default=16, help='files submitted to a worker at once')
+    command.set_defaults(run=dtmf_decode)
+
+    command = commands.add_parser('filter', help='filter an audio file block by block')
+    command.add_argument('input')
+    command.add_argument('output')
+    command.add_argument('--ftype', choices=['butter', 'cheby1', 'cheby2', 'ellip'], default='butter')
+    command.add_argument('--btype', choices=['lowpass', 'highpass', 'bandpass', 'bandstop'], default='lowpass')
+    command.add_argument('--lowcut', type=float, default=1, help='Hz')
+    command.add_argument('--highcut', type=float, default=3000, help='Hz')
+    command.add_argument('--order', type=int, default=4)
+    command.add_argument('--block-size', type=int, default=65536)
+    command.add_argument('--spectrogram', help='also write the STFT magnitudes of the output to this file')
+    command.set_defaults(run=filter_file)
+
+    command = commands.add_parser('resample', help='decimate a signal, optionally back to its sample rate')
+    command.add_argument('input', help='audio or .npy file')
+    command.add_argument('output', help='.wav or .npy file')
+    command.add_argument('--factor', type=int, required=True, help='downsampling factor')
+    command.add_argument('--mode', choices=['fft', 'polyphase', 'cascade'], default='polyphase')
+    command.add_argument('--ftype', choices=['fir', 'iir'], default='fir', help='anti-aliasing filter type')
+    command.add_argument('--restore', action='store_true', help='upsample back to the original sample rate')
+    command.add_argument('--sample-rate', type=int, default=100000, help='sample rate of .npy inputs')
+    command.set_defaults(run=resample)
+
+    command = commands.add_parser('serve', help='process tone strings or file paths from stdin or a local socket')
+    command.add_argument('--unix', help='listen on a Unix socket at this path')
+    command.add_argument('--port', type=int, help='listen on this localhost TCP port')
+    command.add_argument('--filter', nargs=5, action='append', metavar=('FTYPE', 'BTYPE', 'LOWCUT', 'HIGHCUT', 'ORDER'),
+                         help='filter stage applied to requested files, may be repeated')
+    command.add_argument('--filter-output', help='directory of the filtered files')
+    command.add_argument('--sos-cache', help='.npz file the designed filters are loaded from and saved to')
+    command.set_defaults(run=serve)
+
+    command = commands.add_parser('check', help='check the fast implementations against the reference ones')
+    command.set_defaults(run=check)
+
+    command = commands.add_parser('importtime', help='measure the import time of the modules')
+    command.add_argument('--repeat', type=int, default=3)
+    command.add_argument('--baseline', help='JSON file written by a previous --output')
+    command.add_argument('--output', help='write the timings to this JSON file')
+    command.set_defaults(run=benchmark_imports)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
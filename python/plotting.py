@@ -0,0 +1,200 @@
+import hashlib
+import io
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from lazy import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')
+mlab = lazy_import('matplotlib.mlab')
+
+# Set to `png` or `svg` (any other non-empty value means `png`) to start in headless mode
+HEADLESS_ENV = 'MEDIA_HEADLESS'
+
+headless = False
+image_format = 'png'
+on_render = None
+figures = {}
+envelopes = OrderedDict()
+envelope_cache_size = 64
+rc_params = {}
+
+
+def set_headless(enabled=True, fmt='png', callback=None):
+    """
+    Switch the plotting helpers between GUI and headless rendering.
+
+    In headless mode figures are drawn with the Agg backend into in-memory `fmt`
+    ('png' or 'svg') buffers instead of being shown, and every figure key keeps a
+    single Figure/Axes set whose lines are updated in place between calls.
+    `callback` is called with every rendered buffer.
+    """
+    global headless, image_format, on_render
+    headless = enabled
+    image_format = fmt
+    on_render = callback
+    if enabled:
+        plt.switch_backend('Agg')
+
+
+def set_rc(group, **kwargs):
+    """
+    Deferred `plt.rc`: the settings are applied when a figure is created, so matplotlib is only imported then.
+    """
+    rc_params.update({f'{group}.{name}': value for name, value in kwargs.items()})
+
+
+def apply_rc():
+    if rc_params:
+        plt.rcParams.update(rc_params)
+
+
+def get_figure(key, nrows=1, **kwargs):
+    """
+    Return `(figure, axes)` with `nrows` stacked axes for the figure identified by `key`.
+
+    A new figure is created on every call in GUI mode, while headless mode reuses the
+    figure created for the same key and number of axes.
+    """
+    if headless and key in figures and len(figures[key][1]) == nrows:
+        return figures[key]
+
+    if headless and key in figures:
+        plt.close(figures[key][0])
+
+    apply_rc()
+    fig, axes = plt.subplots(nrows, 1, squeeze=False, **kwargs)
+    axes = list(axes[:, 0])
+    if headless:
+        figures[key] = fig, axes
+    return fig, axes
+
+
+def plot(ax, x, y, *args, **kwargs):
+    """
+    Plot `y` against `x` on `ax`, updating the existing lines with `set_data` when the axes are reused.
+    """
+    y = np.asarray(y)
+    columns = y.reshape(len(y), -1)
+    if headless and len(ax.lines) == columns.shape[1]:
+        for line, column in zip(ax.lines, columns.T):
+            line.set_data(x, column)
+        ax.relim()
+        ax.autoscale_view()
+        return ax.lines
+
+    for line in list(ax.lines):
+        line.remove()
+    return ax.plot(x, y, *args, **kwargs)
+
+
+def min_max_envelope(y, columns, start=0, stop=None):
+    """
+    Reduce `y[start:stop]` to the minimum and maximum of each of `columns` equal segments.
+
+    Returns the sample index where every segment starts, twice, and the interleaved
+    minimums and maximums, so the line drawn through them covers every sample of the
+    segment. Ranges of at most `2 * columns` samples are returned unchanged.
+    """
+    stop = len(y) if stop is None else stop
+    length = stop - start
+    if length <= 2 * columns:
+        return np.arange(start, stop), np.asarray(y[start:stop])
+
+    segment = np.asarray(y[start:stop])
+    if length % columns == 0:
+        blocks = segment.reshape(columns, -1)
+        edges = np.arange(columns) * blocks.shape[1]
+        lows, highs = blocks.min(axis=1), blocks.max(axis=1)
+    else:
+        edges = np.linspace(0, length, columns, endpoint=False).astype(int)
+        lows, highs = np.minimum.reduceat(segment, edges), np.maximum.reduceat(segment, edges)
+    return np.repeat(start + edges, 2), np.column_stack([lows, highs]).ravel()
+
+
+def get_envelope(key, y, columns, start, stop):
+    """
+    `min_max_envelope` cached for the last `envelope_cache_size` signals, zoom ranges and widths.
+    """
+    key = (key, columns, start, stop)
+    if key not in envelopes:
+        envelopes[key] = min_max_envelope(y, columns, start, stop)
+        while len(envelopes) > envelope_cache_size:
+            envelopes.popitem(last=False)
+    envelopes.move_to_end(key)
+    return envelopes[key]
+
+
+def sample_range(x, length, xlim):
+    """
+    Range of sample indices of a signal of `length` samples visible between the `xlim` limits.
+    """
+    if callable(x):
+        origin = x(0)
+        bounds = (np.asarray(xlim) - origin) / (x(1) - origin)
+        start, stop = int(np.floor(bounds[0])), int(np.ceil(bounds[1])) + 1
+    else:
+        start, stop = np.searchsorted(x, xlim[0]), np.searchsorted(x, xlim[1], side='right')
+    return max(start, 0), max(min(stop, length), 0)
+
+
+def plot_envelope(ax, x, y, *args, **kwargs):
+    """
+    Plot a long signal with at most two points per pixel column of `ax`.
+
+    `x` is an array of the sample positions, or a function mapping sample indices to
+    positions linearly (e.g. `AudioSource.times`), so no full-length axis is needed.
+    Only the samples inside manually set x limits are reduced, and in GUI mode the
+    envelope is recomputed, and cached per zoom level, whenever the axes are zoomed.
+    """
+    y = np.asarray(y)
+    key = hashlib.sha1(np.ascontiguousarray(y).view(np.uint8)).hexdigest()
+
+    def envelope(xlim=None):
+        start, stop = (0, len(y)) if xlim is None else sample_range(x, len(y), xlim)
+        index, values = get_envelope(key, y, int(np.ceil(ax.get_window_extent().width)), start, stop)
+        return (x(index) if callable(x) else np.asarray(x)[index]), values
+
+    lines = plot(ax, *envelope(None if ax.get_autoscalex_on() else ax.get_xlim()), *args, **kwargs)
+    if not headless:
+        line, = lines
+        ax.callbacks.connect('xlim_changed', lambda axes: line.set_data(*envelope(axes.get_xlim())))
+    return lines
+
+
+def magnitude_spectrum(ax, x, Fs=2):
+    """
+    Reusable counterpart of `Axes.magnitude_spectrum`.
+    """
+    spectrum, freqs = mlab.magnitude_spectrum(x, Fs=Fs)
+    return plot(ax, freqs, spectrum)
+
+
+def clear_images(ax):
+    """
+    Remove meshes and images, which cannot be updated in place, before drawing them again.
+    """
+    for artist in list(ax.collections) + list(ax.images):
+        artist.remove()
+
+
+def show(fig):
+    """
+    Show `fig` in GUI mode, or render it into a buffer and return it in headless mode.
+    """
+    if not headless:
+        plt.show()
+        return None
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=image_format)
+    buffer.seek(0)
+    if on_render is not None:
+        on_render(buffer)
+    return buffer
+
+
+if os.environ.get(HEADLESS_ENV):
+    set_headless(fmt='svg' if os.environ[HEADLESS_ENV] == 'svg' else 'png')
@@ -0,0 +1,171 @@
+import json
+import os
+import socketserver
+import sys
+from time import perf_counter as timer
+
+import numpy as np
+
+import dtmf_batch
+import task4
+import task6
+
+# Silence before and after every synthesized tone, s
+TONE_GAP = 0.05
+
+
+class Service:
+    """
+    Request processor kept warm between requests: modules imported, filters designed and caches filled.
+
+    A request is one line. The path of an existing file is decoded for DTMF digits and,
+    when `filter_output` is set, also filtered into that directory through the chain of
+    `filters` stages (`task6.FilterChain.add` arguments). Any other line is a tone string
+    such as `159#`, synthesized with task4 and decoded back.
+
+    Example of usage :
+
+        service = Service(filters=[('cheby1', 'bandstop', 100, 1000, 4)], filter_output='./filtered')
+        print(service.handle('159#'))
+    """
+
+    def __init__(self, filters=(), filter_output=None, sos_cache=None, sample_rates=(task6.Fs,)):
+        if sos_cache is not None and os.path.exists(sos_cache):
+            task6.load_sos_cache(sos_cache)
+        self.filters = list(filters)
+        self.filter_output = filter_output
+        if filter_output is not None:
+            os.makedirs(filter_output, exist_ok=True)
+        self.chains = {}
+        self.latencies = []
+
+        for sample_rate in sample_rates:
+            self.get_chain(sample_rate)
+        self.process('1')
+
+    def get_chain(self, sample_rate):
+        if sample_rate not in self.chains:
+            chain = task6.FilterChain(sample_rate)
+            for stage in self.filters:
+                chain.add(*stage)
+            self.chains[sample_rate] = chain
+        return self.chains[sample_rate]
+
+    def decode_tones(self, tones):
+        gap = np.zeros(int(TONE_GAP * task4.sr))
+        sig = np.concatenate([gap] + [np.concatenate([task4.generate_signal(task4.DTMF_TABLE[tone.upper()]), gap])
+                                      for tone in tones])
+        events = task4.DTMFStreamDecoder(task4.sr).process(sig)
+        return {'tones': tones, 'digits': ''.join(event.digit for event in events)}
+
+    def filter_file(self, path):
+        source = task6.open_audio(path)
+        output = os.path.join(self.filter_output, os.path.basename(path))
+        chain = self.get_chain(source.sample_rate)
+        task6.write_blocks(task6.stream_filter(source.blocks(), chain.sos), output, source.sample_rate)
+        return output
+
+    def process(self, request):
+        if os.path.isfile(request):
+            result = dtmf_batch.decode_file(request)
+            if self.filter_output is not None and self.filters:
+                result['filtered'] = self.filter_file(request)
+            return result
+
+        try:
+            return self.decode_tones(request)
+        except KeyError as error:
+            return {'tones': request, 'error': f'unknown tone {error}'}
+
+    def handle(self, request):
+        """
+        Process one request line and return its result with the latency in milliseconds.
+
+        A failed request is answered with an error record, so it does not stop the service.
+        """
+        start = timer()
+        try:
+            result = self.process(request)
+        except Exception as error:
+            result = {'error': f'{type(error).__name__}: {error}'}
+        latency = (timer() - start) * 1e3
+        self.latencies.append(latency)
+        return dict(result, request=request, latency_ms=round(latency, 3))
+
+    def summary(self):
+        if not self.latencies:
+            return {'requests': 0}
+        latencies = np.array(self.latencies)
+        return {
+            'requests': len(latencies),
+            'mean_ms': round(latencies.mean(), 3),
+            'p50_ms': round(np.percentile(latencies, 50), 3),
+            'p99_ms': round(np.percentile(latencies, 99), 3),
+        }
+
+
+def serve_lines(service, lines, output):
+    """
+    Answer every non-empty line of `lines` with a JSON line written to `output`.
+    """
+    for line in lines:
+        request = line.strip()
+        if request:
+            output.write(json.dumps(service.handle(request), ensure_ascii=False) + '\n')
+            output.flush()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            request = line.decode().strip()
+            if request:
+                response = self.server.service.handle(request)
+                self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode())
+
+
+def serve_socket(service, unix_path=None, port=None):
+    """
+    Answer requests sent over a Unix socket at `unix_path`, or over TCP on localhost `port`, until interrupted.
+
+    Connections are served one after another by the same warm process.
+    """
+    if unix_path is not None:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        server = socketserver.UnixStreamServer(unix_path, RequestHandler)
+    else:
+        server = socketserver.TCPServer(('127.0.0.1', port), RequestHandler)
+
+    server.service = service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_path is not None and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+
+def serve(filters=(), filter_output=None, sos_cache=None, unix_path=None, port=None):
+    """
+    Run a warm `Service` over stdin/stdout or a local socket and print its latency summary to stderr.
+    """
+    start = timer()
+    service = Service(filters, filter_output, sos_cache)
+    print(f'ready in {timer() - start:.3f} s', file=sys.stderr)
+
+    if unix_path is None and port is None:
+        serve_lines(service, sys.stdin, sys.stdout)
+    else:
+        serve_socket(service, unix_path, port)
+
+    if sos_cache is not None:
+        task6.save_sos_cache(sos_cache)
+    print(json.dumps(service.summary()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    serve()
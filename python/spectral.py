@@ -0,0 +1,160 @@
+import inspect
+from collections import namedtuple
+
+import numpy as np
+import scipy.fft
+
+from lazy import lazy_import
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+signal = lazy_import('scipy.signal')
+
+# Threads used by the transforms when a call does not pass `workers`
+default_workers = 1
+
+NUMPY_FFT_OUT = 'out' in inspect.signature(np.fft.fft).parameters
+
+plans = {}
+buffers = {}
+windows = {}
+
+Spectrum = namedtuple('Spectrum', ['freqs', 'magnitude', 'phase', 'power', 'terms'])
+
+
+def set_workers(workers):
+    global default_workers
+    default_workers = workers
+
+
+def empty(shape, dtype):
+    if pyfftw is not None:
+        return pyfftw.empty_aligned(shape, dtype=dtype)
+    return np.empty(shape, dtype=dtype)
+
+
+def get_buffer(name, shape, dtype):
+    """
+    Preallocated array kept for `name`, shape and dtype and handed out again on every request.
+    """
+    key = (name, shape, np.dtype(dtype).str)
+    if key not in buffers:
+        buffers[key] = empty(shape, dtype)
+    return buffers[key]
+
+
+def fit_length(x, n):
+    if x.shape[-1] >= n:
+        return x[..., :n]
+    padding = [(0, 0)] * (x.ndim - 1) + [(0, n - x.shape[-1])]
+    return np.pad(x, padding)
+
+
+def get_plan(kind, in_shape, in_dtype, out_shape, out_dtype, threads):
+    """
+    pyFFTW plan for a transform kind, shapes and dtypes, planned once and reused.
+    """
+    # irfft inputs of `n // 2 + 1` terms are shared by even and odd `n`, told apart by the output shape
+    key = (kind, in_shape, np.dtype(in_dtype).str, out_shape, threads)
+    if key not in plans:
+        direction = 'FFTW_BACKWARD' if kind in ('ifft', 'irfft') else 'FFTW_FORWARD'
+        plans[key] = pyfftw.FFTW(empty(in_shape, in_dtype), empty(out_shape, out_dtype), axes=(-1,),
+                                 direction=direction, threads=threads)
+    return plans[key]
+
+
+def transform(kind, x, n, workers, buffer):
+    x = np.asarray(x)
+    single = x.dtype in (np.float32, np.complex64)
+    real_dtype, complex_dtype = (np.float32, np.complex64) if single else (np.float64, np.complex128)
+
+    if kind == 'irfft':
+        n = 2 * (x.shape[-1] - 1) if n is None else n
+        in_len, out_len, in_dtype, out_dtype = n // 2 + 1, n, complex_dtype, real_dtype
+    else:
+        n = x.shape[-1] if n is None else n
+        in_len, out_len = (n, n // 2 + 1) if kind == 'rfft' else (n, n)
+        in_dtype = real_dtype if kind == 'rfft' else complex_dtype
+        out_dtype = complex_dtype
+
+    out_shape = x.shape[:-1] + (out_len,)
+    out = empty(out_shape, out_dtype) if buffer is None else get_buffer(buffer, out_shape, out_dtype)
+    threads = workers or default_workers or 1
+
+    if pyfftw is not None:
+        plan = get_plan(kind, x.shape[:-1] + (in_len,), in_dtype, out_shape, out_dtype, threads)
+        plan.input_array[...] = fit_length(x, in_len)
+        np.copyto(out, plan())
+    elif NUMPY_FFT_OUT and threads == 1:
+        getattr(np.fft, kind)(x, n, out=out)
+    else:
+        np.copyto(out, getattr(scipy.fft, kind)(x, n, workers=threads))
+    return out
+
+
+def fft(x, n=None, workers=None, buffer=None):
+    """
+    Complex FFT along the last axis.
+
+    With pyFFTW installed every length and dtype is planned once; otherwise the
+    transform is done by NumPy, or by `scipy.fft` when running on several `workers`.
+    When `buffer` names a buffer, the result is written into an array preallocated for
+    that name, shape and dtype, which the next call with the same name overwrites.
+    """
+    return transform('fft', x, n, workers, buffer)
+
+
+def ifft(x, n=None, workers=None, buffer=None):
+    """
+    Inverse of `fft`, same options.
+    """
+    return transform('ifft', x, n, workers, buffer)
+
+
+def rfft(x, n=None, workers=None, buffer=None):
+    """
+    FFT of a real signal returning the `n // 2 + 1` non-negative frequency terms, same options as `fft`.
+    """
+    return transform('rfft', x, n, workers, buffer)
+
+
+def irfft(x, n=None, workers=None, buffer=None):
+    """
+    Inverse of `rfft` returning `n` real samples, same options as `fft`.
+    """
+    return transform('irfft', x, n, workers, buffer)
+
+
+def get_window(window, length):
+    key = (window, length)
+    if key not in windows:
+        windows[key] = signal.get_window(window, length)
+    return windows[key]
+
+
+def real_spectrum(x, fs, window='boxcar', n=None, workers=None):
+    """
+    Spectrum of a real signal computed with `rfft`.
+
+    Returns a `Spectrum` with the frequency axis in Hz and the magnitude, phase and power
+    of the `n // 2 + 1` non-negative frequency terms, `terms` holding the complex values
+    for `inverse_real_spectrum`. `window` is any `scipy.signal.get_window` window.
+    """
+    x = np.asarray(x)
+    n = x.shape[-1] if n is None else n
+    if window != 'boxcar':
+        x = x * get_window(window, x.shape[-1])
+
+    terms = rfft(x, n, workers)
+    magnitude = np.abs(terms)
+    return Spectrum(np.fft.rfftfreq(n, 1. / fs), magnitude, np.angle(terms), magnitude ** 2, terms)
+
+
+def inverse_real_spectrum(terms, n, workers=None):
+    """
+    Real signal of `n` samples with the given non-negative frequency terms.
+    """
+    return irfft(terms, n, workers)
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+import spectral
+from lazy import lazy_import
+
+signal = lazy_import('scipy.signal')
+
+# Directory of the memory-mapped magnitude files, shared between runs
+CACHE_DIR_ENV = 'MEDIA_SPECTROGRAM_DIR'
+
+cache_dir = os.environ.get(CACHE_DIR_ENV, os.path.join(tempfile.gettempdir(), 'media_spectrograms'))
+cache_size = 32
+# Bytes of magnitude files kept in `cache_dir`, the least recently used ones are removed first
+cache_dir_size = 512 * 2 ** 20
+# Frames transformed at once, bounding the temporary windowed frames to a few MiB
+batch_frames = 256
+stores = OrderedDict()
+spectrograms = OrderedDict()
+
+
+def content_hash(x):
+    """
+    Hash of the samples of `x` together with its shape and dtype.
+    """
+    x = np.ascontiguousarray(x)
+    digest = hashlib.sha1(x.view(np.uint8))
+    digest.update(f'{x.shape}{x.dtype.str}'.encode())
+    return digest.hexdigest()
+
+
+def remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+    return value
+
+
+class SpectrogramStore:
+    """
+    STFT magnitudes of a growing signal kept as float32 in a memory-mapped file.
+
+    Frames follow `librosa.stft` with the default `center=True, pad_mode='constant'`:
+    the signal is preceded by `n_fft // 2` zeros and, once `finish` is called, followed
+    by as many, so a finished store holds `1 + len(signal) // hop_length` frames.
+    Samples passed to `append` are turned into every frame they complete, only the
+    `n_fft - hop_length` samples needed by the next frame are kept in memory.
+
+    Example of usage :
+
+        store = SpectrogramStore('/tmp/stream.f32')
+        for block in blocks:
+            store.append(block)
+        magnitude = store.finish()
+    """
+
+    def __init__(self, path, n_fft=2048, hop_length=512, window='hann', capacity=1024):
+        self.path = path
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.window = spectral.get_window(window, n_fft)
+        self.bins = n_fft // 2 + 1
+        self.frames = 0
+        self.finished = False
+        self.pending = np.zeros(n_fft // 2, dtype=np.float32)
+        self.data = np.memmap(path, dtype=np.float32, mode='w+', shape=(max(capacity, 1), self.bins))
+
+    @property
+    def magnitude(self):
+        """
+        `(bins, frames)` view of the stored magnitudes, laid out like `librosa.stft`.
+        """
+        return self.data[:self.frames].T
+
+    def reserve(self, frames):
+        if frames <= len(self.data):
+            return
+        capacity = max(frames, 2 * len(self.data))
+        self.data.flush()
+        self.data = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(capacity, self.bins))
+
+    def append(self, samples):
+        """
+        Add samples to the signal and store the frames they complete; returns the number of new frames.
+        """
+        if self.finished:
+            raise ValueError('Cannot append to a finished spectrogram')
+        self.pending = np.concatenate([self.pending, np.asarray(samples, dtype=np.float32)])
+        count = (len(self.pending) - self.n_fft) // self.hop_length + 1
+        if count <= 0:
+            return 0
+        self.reserve(self.frames + count)
+
+        frames = np.lib.stride_tricks.sliding_window_view(self.pending, self.n_fft)[::self.hop_length]
+        for start in range(0, count, batch_frames):
+            batch = frames[start:min(start + batch_frames, count)]
+            self.data[self.frames:self.frames + len(batch)] = np.abs(spectral.rfft(batch * self.window))
+            self.frames += len(batch)
+
+        self.pending = self.pending[count * self.hop_length:].copy()
+        return count
+
+    def finish(self):
+        """
+        Pad the end of the signal, store the last frames and return `magnitude`.
+        """
+        if not self.finished:
+            self.append(np.zeros(self.n_fft // 2, dtype=np.float32))
+            self.finished = True
+            self.pending = self.pending[:0]
+            self.data.flush()
+        return self.magnitude
+
+
+def store_path(key):
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.f32')
+
+
+def evict_files(keep):
+    """
+    Remove the least recently used magnitude files other than `keep` until `cache_dir` fits in `cache_dir_size`.
+    """
+    files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(cache_dir)
+             if entry.name.endswith('.f32') and entry.path != keep]
+    total = os.path.getsize(keep) + sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= cache_dir_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Still mapped by another process on Windows
+            continue
+        total -= size
+
+
+def stft_magnitude(x, n_fft=2048, hop_length=512, window='hann'):
+    """
+    `np.abs(librosa.stft(x))` as a float32 `(bins, frames)` memory-mapped array.
+
+    Results are keyed by the content hash of `x` and the STFT parameters, kept in memory
+    for the most recent `cache_size` signals and reused from `cache_dir` across runs.
+    The files in `cache_dir` are limited to `cache_dir_size` bytes.
+    """
+    x = np.asarray(x)
+    key = (content_hash(x), n_fft, hop_length, window)
+    if key in stores:
+        stores.move_to_end(key)
+        return stores[key]
+
+    path = store_path(key)
+    shape = (1 + len(x) // hop_length, n_fft // 2 + 1)
+    if not os.path.exists(path) or os.path.getsize(path) != np.prod(shape) * 4:
+        store = SpectrogramStore(path + '.part', n_fft, hop_length, window, capacity=shape[0])
+        for start in range(0, len(x), batch_frames * hop_length):
+            store.append(x[start:start + batch_frames * hop_length])
+        store.finish()
+        del store
+        os.replace(path + '.part', path)
+        evict_files(path)
+    else:
+        os.utime(path)
+
+    return remember(stores, key, np.memmap(path, dtype=np.float32, mode='r', shape=shape).T)
+
+
+def spectrogram(x, fs=1.0, **kwargs):
+    """
+    Memoized `scipy.signal.spectrogram` returning `(f, t, Sxx)` with a float32 `Sxx`.
+    """
+    x = np.asarray(x)
+    key = (content_hash(x), fs, tuple(sorted(kwargs.items())))
+    if key not in spectrograms:
+        f, t, Sxx = signal.spectrogram(x, fs, **kwargs)
+        return remember(spectrograms, key, (f, t, Sxx.astype(np.float32)))
+    spectrograms.move_to_end(key)
+    return spectrograms[key]
@@ -1,6 +1,6 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.fftpack import fft, ifft, rfftfreq
+import plotting
+import spectral
 from math import pi
 from numpy import cos
 
@@ -13,7 +13,6 @@ Fs = 40000
 
 t = np.arange(0, 300. / Fs, 1. / Fs)
 n = np.size(t)
-fr = rfftfreq(n, 1. / Fs)
 
 def generate_am_signal(amp_c=1.0, amp_s=1.0, km=1.0, fc=10.0, fs=2.0):
     """
@@ -55,13 +54,86 @@ def generate_fm_signal(amp_c=1.0, amp_s=1.0, km=1.0, fc=10.0, fs=2.0):
     return amp_c * cos(2 * pi * fc * t + amp_s * km * cos(2 * pi * fs * t))
 
 
+# Variants evaluated at once in float64 before the bank is stored as its dtype
+bank_chunk_size = 64
+
+
+def bank_parameters(dtype, *params):
+    """
+    Broadcast scalar or 1-D parameters against each other into `(variants, 1)` columns.
+    """
+    params = np.broadcast_arrays(*[np.atleast_1d(np.asarray(param, dtype=dtype)) for param in params])
+    return [param[:, np.newaxis] for param in params]
+
+
+def evaluate_bank(samples, params, time, dtype):
+    """
+    Fill a `(variants, samples)` matrix of `dtype` with `samples(*params, time)`.
+
+    The expression is evaluated in float64 for `bank_chunk_size` variants at a time, so
+    the phases `2 * pi * f * time` of long signals stay accurate in a float32 bank.
+    """
+    params = bank_parameters(np.float64, *params)
+    time = np.asarray(time, dtype=np.float64)
+    bank = np.empty((len(params[0]), len(time)), dtype=dtype)
+    for start in range(0, len(bank), bank_chunk_size):
+        bank[start:start + bank_chunk_size] = samples(*[param[start:start + bank_chunk_size] for param in params], time)
+    return bank
+
+
+def am_samples(amp_c, amp_s, km, fc, fs, time):
+    return amp_c * (1 + km * amp_s * cos(2 * pi * fs * time)) * cos(2 * pi * fc * time)
+
+
+def fm_samples(amp_c, amp_s, km, fc, fs, time):
+    return amp_c * cos(2 * pi * fc * time + amp_s * km * cos(2 * pi * fs * time))
+
+
+def generate_am_bank(amp_c=1.0, amp_s=1.0, km=1.0, fc=10.0, fs=2.0, time=t, dtype=np.float64):
+    """
+    Create a bank of AM signals in one vectorized expression
+
+    Parameters are those of `generate_am_signal`, each a scalar or a 1-D array of per-variant
+    values; they are broadcast against each other. Use `np.meshgrid(...).ravel()` values for
+    a full grid. Returns a `(variants, samples)` matrix of `dtype` signals over `time`.
+    """
+    return evaluate_bank(am_samples, (amp_c, amp_s, km, fc, fs), time, dtype)
+
+
+def generate_fm_bank(amp_c=1.0, amp_s=1.0, km=1.0, fc=10.0, fs=2.0, time=t, dtype=np.float64):
+    """
+    Create a bank of FM signals in one vectorized expression
+
+    Same parameters and result as `generate_am_bank`, for `generate_fm_signal` signals.
+    """
+    return evaluate_bank(fm_samples, (amp_c, amp_s, km, fc, fs), time, dtype)
+
+
+def iterate_bank(generate_bank, chunk_size=1024, time=t, dtype=np.float64, **params):
+    """
+    Yield a large bank from `generate_am_bank` or `generate_fm_bank` in chunks of at most `chunk_size` variants.
+
+    Example of usage :
+
+        for chunk in iterate_bank(generate_am_bank, fc=np.linspace(1000, 3000, 100000), dtype=np.float32):
+            ...
+    """
+    names = list(params)
+    values = np.broadcast_arrays(*[np.atleast_1d(params[name]) for name in names])
+    variants = len(values[0]) if values else 1
+    for start in range(0, variants, chunk_size):
+        chunk = {name: value[start:start + chunk_size] for name, value in zip(names, values)}
+        yield generate_bank(time=time, dtype=dtype, **chunk)
+
+
 def draw_graph(x, y, title='', xlabel=''):
-    plt.title(title)
-    plt.plot(x, y)
-    plt.ylabel('Amplitude')
-    plt.xlabel(xlabel)
-    plt.grid(True)
-    plt.show()
+    fig, (ax,) = plotting.get_figure('graph')
+    ax.set_title(title)
+    plotting.plot(ax, x, y)
+    ax.set_ylabel('Amplitude')
+    ax.set_xlabel(xlabel)
+    ax.grid(True)
+    plotting.show(fig)
 
 
 def draw_signal_graph(s, title='Signal', xlabel='Time, s'):
@@ -69,12 +141,12 @@ def draw_signal_graph(s, title='Signal', xlabel='Time, s'):
 
 
 def draw_spectrum_graph(spectrum, signal_title='Signal', xlabel='Frequency, Hz'):
-    draw_graph(2 * fr, spectrum, f"Spectrum of {signal_title}", xlabel)
+    draw_graph(spectrum.freqs, spectrum.magnitude, f"Spectrum of {signal_title}", xlabel)
 
 
 def draw_signal_and_spectrum(signal, signal_title):
     draw_signal_graph(signal, signal_title)
-    spectrum = abs(fft(signal))
+    spectrum = spectral.real_spectrum(signal, Fs)
     draw_spectrum_graph(spectrum, signal_title)
 
 
@@ -95,24 +167,25 @@ def task2(fm_signal, noised_signal):
 
 
 def task3(noised_signal):
-    spectrum = abs(fft(noised_signal))
-    spectrum[spectrum < 200] = 0
-    draw_spectrum_graph(spectrum, 'Filtered AM-signal')
-    return spectrum
+    spectrum = spectral.real_spectrum(noised_signal, Fs)
+    terms = np.where(spectrum.magnitude < 200, 0, spectrum.terms)
+    draw_spectrum_graph(spectrum._replace(magnitude=np.abs(terms)), 'Filtered AM-signal')
+    return terms
 
 
-def task4(spectrum):
-    filtered_signal = ifft(spectrum).real
+def task4(terms):
+    filtered_signal = spectral.inverse_real_spectrum(terms, n)
     draw_signal_and_spectrum(filtered_signal, 'IFT AM-signal')
 
 
-pure_am_signal = generate_am_signal(amp_c=A, amp_s=B, fc=f1, fs=f2)
-noised_am_signal = add_noise(pure_am_signal)
-task1(pure_am_signal, noised_am_signal)
+if __name__ == '__main__':
+    pure_am_signal = generate_am_signal(amp_c=A, amp_s=B, fc=f1, fs=f2)
+    noised_am_signal = add_noise(pure_am_signal)
+    task1(pure_am_signal, noised_am_signal)
 
-pure_fm_signal = generate_fm_signal(amp_c=A, amp_s=B, fc=f1, fs=f2)
-noised_fm_signal = add_noise(pure_fm_signal)
-task2(pure_fm_signal, noised_fm_signal)
+    pure_fm_signal = generate_fm_signal(amp_c=A, amp_s=B, fc=f1, fs=f2)
+    noised_fm_signal = add_noise(pure_fm_signal)
+    task2(pure_fm_signal, noised_fm_signal)
 
-sig = task3(noised_am_signal)
-task4(sig)
+    sig = task3(noised_am_signal)
+    task4(sig)
@@ -1,22 +1,27 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import plotting
+import spectral
 from scipy import signal
-from scipy.fftpack import rfft, irfft
+import itertools
 import math
+from scipy.fft import next_fast_len
+from time import perf_counter as timer
+
+# Signal length from which `sum_of_correlation` switches to the FFT method
+CORRELATION_FFT_THRESHOLD = 64
 
 
 def draw_graphs(freq_list, title_list=['', '', '']):
-    plt.figure(figsize=(14, 6), dpi=80)
-    for i in range(3):
-        plt.subplot(3, 1, i + 1)
-        plt.plot(freq_list[i], '-', linewidth=2.0)
-        plt.title(f'{title_list[i]} Signal')
-        plt.xlabel('Samples')
-        plt.ylabel('Amplitude')
-        plt.xlim([0, freq_list[i].size - 1])
-        plt.grid()
-    plt.tight_layout()
-    plt.show()
+    fig, axes = plotting.get_figure('graphs', 3, figsize=(14, 6), dpi=80)
+    for i, ax in enumerate(axes):
+        plotting.plot(ax, np.arange(freq_list[i].size), freq_list[i], '-', linewidth=2.0)
+        ax.set_title(f'{title_list[i]} Signal')
+        ax.set_xlabel('Samples')
+        ax.set_ylabel('Amplitude')
+        ax.set_xlim([0, freq_list[i].size - 1])
+        ax.grid(True)
+    fig.tight_layout()
+    plotting.show(fig)
 
 
 def convolve(signal1, signal2):
@@ -24,12 +29,143 @@ def convolve(signal1, signal2):
 
 
 def circle_convolve(signal1, signal2):
-    return irfft(rfft(signal1) * rfft(signal2)) / np.sum(signal1)
+    n = max(len(signal1), len(signal2))
+    return spectral.irfft(spectral.rfft(signal1, n) * spectral.rfft(signal2, n), n) / np.sum(signal1)
+
+
+def rechunk(blocks, block_size):
+    """
+    Regroup an iterable of 1-D arrays into consecutive blocks of `block_size` samples, the last one possibly shorter.
+    """
+    buffer = np.empty(block_size)
+    filled = 0
+    for block in blocks:
+        block = np.asarray(block, dtype=float)
+        offset = 0
+        while offset < len(block):
+            take = min(block_size - filled, len(block) - offset)
+            buffer[filled:filled + take] = block[offset:offset + take]
+            filled += take
+            offset += take
+            if filled == block_size:
+                yield buffer.copy()
+                filled = 0
+    if filled:
+        yield buffer[:filled].copy()
+
+
+def overlap_add_convolve(blocks, kernel, block_size=4096):
+    """
+    Linear convolution of a long signal, given as an iterable of blocks, with `kernel` by overlap-add.
+
+    The kernel spectrum is computed once and the input is processed in blocks of `block_size`
+    samples, so memory use depends on the block and kernel sizes only. Yields output blocks
+    concatenating to `signal.convolve(sig, kernel)`.
+    """
+    kernel = np.asarray(kernel, dtype=float)
+    overlap = len(kernel) - 1
+    nfft = next_fast_len(block_size + overlap)
+    kernel_spectrum = spectral.rfft(kernel, nfft)
+
+    tail = np.zeros(overlap)
+    for block in rechunk(blocks, block_size):
+        spectrum = spectral.rfft(block, nfft, buffer='block') * kernel_spectrum
+        convolved = spectral.irfft(spectrum, nfft)[:len(block) + overlap]
+        convolved[:overlap] += tail
+        yield convolved[:len(block)]
+        tail = convolved[len(block):]
+    if overlap:
+        yield tail
+
+
+def overlap_save_convolve(blocks, kernel, block_size=4096):
+    """
+    Linear convolution of a long signal, given as an iterable of blocks, with `kernel` by overlap-save.
+
+    Same contract as `overlap_add_convolve`; input is consumed in blocks of at least
+    `block_size` samples sized to fill an FFT of fast length.
+    """
+    kernel = np.asarray(kernel, dtype=float)
+    overlap = len(kernel) - 1
+    nfft = next_fast_len(block_size + overlap)
+    kernel_spectrum = spectral.rfft(kernel, nfft)
+
+    history = np.zeros(overlap)
+    for block in rechunk(itertools.chain(blocks, [np.zeros(overlap)]), nfft - overlap):
+        segment = np.concatenate((history, block))
+        spectrum = spectral.rfft(segment, nfft, buffer='block') * kernel_spectrum
+        yield spectral.irfft(spectrum, nfft)[overlap:overlap + len(block)]
+        history = segment[len(segment) - overlap:]
+
+
+def sum_of_correlation_direct(signal1, signal2):
+    return np.array(
+        [np.sum(signal1 * np.roll(signal2, i)) for i in range(math.floor(0.5 * (len(signal1) + len(signal2))))])
+
+
+def sum_of_correlation_fft(signal1, signal2):
+    """
+    Circular cross-correlation over the same lags as `sum_of_correlation_direct` in O(N log N).
+    """
+    if len(signal1) != len(signal2):
+        raise ValueError(f'signals must have the same length, got {len(signal1)} and {len(signal2)}')
+
+    n = len(signal1)
+    spectrum = spectral.rfft(signal1) * np.conj(spectral.rfft(signal2))
+    return spectral.irfft(spectrum, n)[:math.floor(0.5 * (len(signal1) + len(signal2)))]
 
 
 def sum_of_correlation(signal1, signal2):
-    return np.array(
-        [np.sum(signal1 * np.roll(signal2, i)) for i in range(math.floor(0.5 * (len(signal1) + len(signal2))))])
+    """
+    Circular cross-correlation of two equal-length signals, computed directly for short
+    signals and through the FFT from `CORRELATION_FFT_THRESHOLD` samples on.
+    """
+    if len(signal1) < CORRELATION_FFT_THRESHOLD:
+        return sum_of_correlation_direct(signal1, signal2)
+    return sum_of_correlation_fft(signal1, signal2)
+
+
+def compare_correlation(direct, fast):
+    """
+    Raise `ValueError` unless the direct and FFT correlations agree.
+    """
+    if np.shape(direct) != np.shape(fast) or not np.allclose(direct, fast):
+        raise ValueError('sum_of_correlation_direct and sum_of_correlation_fft differ')
+
+
+def check_correlation(sizes=(64, 127, 1000, 1001)):
+    """
+    Check that `sum_of_correlation_fft` matches `sum_of_correlation_direct` on even and odd lengths.
+    """
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        signal1, signal2 = rng.normal(size=size), rng.normal(size=size)
+        compare_correlation(sum_of_correlation_direct(signal1, signal2), sum_of_correlation_fft(signal1, signal2))
+
+
+def benchmark_correlation(sizes=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7), direct_limit=2 * 10 ** 4):
+    """
+    Time the direct and FFT correlations and check they agree with `compare_correlation`.
+
+    The O(N^2) direct method only runs up to `direct_limit` samples.
+    """
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        signal1, signal2 = rng.normal(size=size), rng.normal(size=size)
+
+        start = timer()
+        fast = sum_of_correlation_fft(signal1, signal2)
+        fft_time = timer() - start
+
+        if size > direct_limit:
+            print(f'{size}: fft {fft_time * 1e3:.1f} ms')
+            continue
+
+        start = timer()
+        direct = sum_of_correlation_direct(signal1, signal2)
+        direct_time = timer() - start
+        compare_correlation(direct, fast)
+        print(f'{size}: direct {direct_time * 1e3:.1f} ms, fft {fft_time * 1e3:.1f} ms')
 
 
 def draw_convolve(signal1, signal2, title_list=['Signal', 'Signal']):
@@ -76,10 +212,14 @@ def task4(square_wave, triangular_wave):
     draw_convolve_2(square_wave, triangular_wave, ['Square', 'Triangular'])
 
 
-square_wave = np.repeat([0., 1., 0.], 200)
-triangular_wave = convolve(square_wave, square_wave)
+if __name__ == '__main__':
+    check_correlation()
+
+    square_wave = np.repeat([0., 1., 0.], 200)
+    triangular_wave = convolve(square_wave, square_wave)
 
-# task1(square_wave, triangular_wave)
-task2(square_wave)
-task3(square_wave, triangular_wave)
-# task4(square_wave, triangular_wave)
+    # task1(square_wave, triangular_wave)
+    task2(square_wave)
+    task3(square_wave, triangular_wave)
+    # task4(square_wave, triangular_wave)
+    # benchmark_correlation()
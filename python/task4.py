@@ -1,25 +1,60 @@
 import math
+import time
 import numpy as np
-import matplotlib.pyplot as plt
+import plotting
+from collections import OrderedDict, namedtuple
 from operator import itemgetter
 
 DTMF_TABLE = {
-    1: {'high': 1209, 'low': 697},
-    2: {'high': 1336, 'low': 697},
-    3: {'high': 1477, 'low': 697},
+    '1': {'high': 1209, 'low': 697},
+    '2': {'high': 1336, 'low': 697},
+    '3': {'high': 1477, 'low': 697},
+    'A': {'high': 1633, 'low': 697},
+
+    '4': {'high': 1209, 'low': 770},
+    '5': {'high': 1336, 'low': 770},
+    '6': {'high': 1477, 'low': 770},
+    'B': {'high': 1633, 'low': 770},
+
+    '7': {'high': 1209, 'low': 852},
+    '8': {'high': 1336, 'low': 852},
+    '9': {'high': 1477, 'low': 852},
+    'C': {'high': 1633, 'low': 852},
+
+    '*': {'high': 1209, 'low': 941},
+    '0': {'high': 1336, 'low': 941},
+    '#': {'high': 1477, 'low': 941},
+    'D': {'high': 1633, 'low': 941},
+}
 
-    4: {'high': 1209, 'low': 770},
-    5: {'high': 1336, 'low': 770},
-    6: {'high': 1477, 'low': 770},
+DTMF_LOW_FREQS = sorted({tones['low'] for tones in DTMF_TABLE.values()})
+DTMF_HIGH_FREQS = sorted({tones['high'] for tones in DTMF_TABLE.values()})
 
-    7: {'high': 1209, 'low': 852},
-    8: {'high': 1336, 'low': 852},
-    9: {'high': 1477, 'low': 852},
-}
+# Boundary between the low (row) and high (column) DTMF frequency groups, Hz
+DTMF_GROUP_SPLIT = 1100
+
+# Relative deviation from a nominal DTMF frequency that is still matched to it
+DTMF_TOLERANCE = 0.035
+
+DTMF_INDEX = {(tones['low'], tones['high']): key for key, tones in DTMF_TABLE.items()}
+
+
+def build_frequency_bands(nominal_freqs, tolerance=DTMF_TOLERANCE):
+    """
+    Map every whole frequency in Hz within `tolerance` of a nominal frequency to that nominal frequency.
+    """
+    bands = {}
+    for nominal in nominal_freqs:
+        for freq in range(int(math.ceil(nominal * (1 - tolerance))), int(math.floor(nominal * (1 + tolerance))) + 1):
+            bands[freq] = nominal
+    return bands
+
+
+DTMF_BANDS = build_frequency_bands(DTMF_LOW_FREQS + DTMF_HIGH_FREQS)
 
 A = 10
 B = 2
-sr = 3000
+sr = 8000
 T = 0.5
 t = np.linspace(0, T, int(T * sr), endpoint=False)
 
@@ -27,6 +62,21 @@ f1 = 2000
 f2 = 150
 
 
+def goertzel_bins(window_size, f_step, freqs):
+    """
+    Set of the DFT bins covering every `(start, end)` range of `freqs` for bins `f_step` Hz apart.
+    """
+    bins = set()
+    for f_range in freqs:
+        f_start, f_end = f_range
+        k_start = int(math.floor(f_start / f_step))
+        k_end = int(math.ceil(f_end / f_step))
+
+        if k_end > window_size - 1: raise ValueError('frequency out of range %s' % k_end)
+        bins = bins.union(range(k_start, k_end))
+    return bins
+
+
 def goertzel(samples, sample_rate, *freqs):
     """
     Implementation of the Goertzel algorithm, useful for calculating individual
@@ -48,14 +98,7 @@ def goertzel(samples, sample_rate, *freqs):
 
     # Calculate all the DFT bins we have to compute to include frequencies
     # in `freqs`.
-    bins = set()
-    for f_range in freqs:
-        f_start, f_end = f_range
-        k_start = int(math.floor(f_start / f_step))
-        k_end = int(math.ceil(f_end / f_step))
-
-        if k_end > window_size - 1: raise ValueError('frequency out of range %s' % k_end)
-        bins = bins.union(range(k_start, k_end))
+    bins = goertzel_bins(window_size, f_step, freqs)
 
     # For all the bins, calculate the DFT term
     n_range = range(0, window_size)
@@ -84,48 +127,342 @@ def goertzel(samples, sample_rate, *freqs):
     return freqs, results
 
 
-def get_key_by_value(dictionary, value):
-    if value in list(dictionary.values()):
-        value = list(dictionary.keys())[list(dictionary.values()).index(value)]
-        print('DTMF signal', value, 'received')
-        return value
-    return False
+def goertzel_vectorized(samples, sample_rate, *freqs):
+    """
+    Vectorized counterpart of `goertzel` computing every requested bin at once.
+
+    For an integer bin `k` the Goertzel recurrence over the whole window yields
+    exactly the `k`-th DFT term, so all bins are taken from a single FFT instead
+    of running the recurrence per bin in the interpreter.
 
+    Returns the same `(freqs, results)` pair as `goertzel`, with the bins sorted
+    by frequency: `freqs` is an array of bin frequencies and `results` an array
+    of `(real part, imag part, power)` rows.
 
-def find_key(low, high):
-    return get_key_by_value(DTMF_TABLE, {'high': high, 'low': low})
+    Example of usage :
+
+        freqs, results = goertzel_vectorized(some_samples, 44100, (400, 500), (1000, 1100))
+    """
+    samples = np.asarray(samples, dtype=float)
+    window_size = len(samples)
+    f_step = sample_rate / float(window_size)
+
+    bins = np.array(sorted(goertzel_bins(window_size, f_step, freqs)), dtype=int)
+    if bins.size and bins[-1] <= window_size // 2:
+        spectrum = np.fft.rfft(samples)[bins]
+    else:
+        spectrum = np.fft.fft(samples)[bins]
 
+    results = np.column_stack((spectrum.real, spectrum.imag, np.abs(spectrum) ** 2))
+    return bins * f_step, results
 
-def iterate_in_vicinity(callback, center, offset=10, step=1):
-    return [callback(n) for n in range(center - offset, center + offset, step)]
 
+def compare_goertzel(scalar, vectorized):
+    """
+    Raise `ValueError` unless the `(freqs, results)` of `goertzel` and `goertzel_vectorized` agree.
+    """
+    (scalar_freqs, scalar_results), (vector_freqs, vector_results) = scalar, vectorized
+    order = np.argsort(scalar_freqs)
+    scalar_freqs, scalar_results = np.array(scalar_freqs)[order], np.array(scalar_results)[order]
+    if scalar_freqs.shape != np.shape(vector_freqs) or not np.allclose(scalar_freqs, vector_freqs):
+        raise ValueError('goertzel and goertzel_vectorized computed different bins')
 
-def iterate_in_two_dimensional_vicinity(center_low, center_high, callback):
-    return iterate_in_vicinity(lambda low: (low, iterate_in_vicinity(lambda high: callback(high, low), center_low)),
-                               center_high)
+    scale = np.max(np.abs(scalar_results), initial=0.0) or 1.0
+    error = np.max(np.abs(scalar_results - vector_results), initial=0.0) / scale
+    if error > 1e-9:
+        raise ValueError(f'goertzel and goertzel_vectorized differ by {error:.3g} of the largest term')
+
+
+def check_goertzel(sample_rates=(8000, 44100), duration=0.02):
+    """
+    Check that `goertzel_vectorized` matches `goertzel` on short DTMF tones; raises `ValueError` otherwise.
+    """
+    ranges = ((697, 1209), (697, 1336), (697, 1477))
+    for sample_rate in sample_rates:
+        tone_t = np.arange(int(duration * sample_rate)) / sample_rate
+        signal = np.sin(2 * np.pi * 1336 * tone_t) + np.sin(2 * np.pi * 770 * tone_t)
+        compare_goertzel(goertzel(signal, sample_rate, *ranges), goertzel_vectorized(signal, sample_rate, *ranges))
+
+
+def benchmark_goertzel(sample_rates=(8000, 44100, 100000), duration=0.5, repeat=3):
+    """
+    Compare the scalar and vectorized Goertzel implementations on a DTMF tone.
+
+    Checks that both return the same bins and terms with `compare_goertzel` and prints
+    the best of `repeat` timings for each sample rate.
+    """
+    ranges = ((697, 1209), (697, 1336), (697, 1477))
+    for sample_rate in sample_rates:
+        tone_t = np.linspace(0, duration, int(duration * sample_rate), endpoint=False)
+        signal = np.sin(2 * np.pi * 1336 * tone_t) + np.sin(2 * np.pi * 770 * tone_t)
+
+        timings = []
+        for implementation in (goertzel, goertzel_vectorized):
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = implementation(signal, sample_rate, *ranges)
+                best = min(best, time.perf_counter() - start)
+            timings.append((best, result))
+
+        (scalar_time, scalar_result), (vector_time, vector_result) = timings
+        compare_goertzel(scalar_result, vector_result)
+
+        print(f'{sample_rate} Hz: scalar {scalar_time * 1e3:.1f} ms, vectorized {vector_time * 1e3:.2f} ms, '
+              f'speedup x{scalar_time / vector_time:.0f}')
+
+
+DTMFEvent = namedtuple('DTMFEvent', ['digit', 'start', 'confidence'])
+
+goertzel_bases = OrderedDict()
+goertzel_bases_size = 16
+
+
+def get_goertzel_basis(sample_rate, block_size):
+    """
+    DFT terms of the DTMF frequencies over one detection block, computed once per sample rate and block size.
+
+    Bases are kept in an LRU cache of `goertzel_bases_size` entries, so streams cycling
+    through sample rates cannot grow it; decoders keep a reference to their own basis.
+    """
+    key = (sample_rate, block_size)
+    if key in goertzel_bases:
+        goertzel_bases.move_to_end(key)
+        return goertzel_bases[key]
+
+    freqs = np.array(DTMF_LOW_FREQS + DTMF_HIGH_FREQS)
+    basis = goertzel_bases[key] = np.exp(-2j * np.pi * np.outer(np.arange(block_size), freqs) / sample_rate)
+    if len(goertzel_bases) > goertzel_bases_size:
+        goertzel_bases.popitem(last=False)
+    return basis
+
+
+class DTMFStreamDecoder:
+    """
+    Incremental DTMF decoder for audio arriving in chunks, e.g. 10 ms frames from a socket.
+
+    The Goertzel terms of the DTMF row and column frequencies are accumulated sample by
+    sample over half-blocks of `block_duration / 2` seconds, so the state carried between
+    chunks is a handful of numbers and the work per chunk is proportional to its length.
+    Every two consecutive half-blocks form a detection window of `block_duration` seconds,
+    so windows overlap by half. A window is classified as a digit when the strongest row
+    and column tones hold at least `min_confidence` of the window energy together (1.0 for
+    a clean two-tone signal) and `min_tone_share` each, their levels differ by at most
+    `max_twist_db`, and each one is at least `min_peak_ratio_db` above the next tone of its
+    group. A lone tone near a DTMF frequency is therefore not taken for a digit. Both tones
+    must also be present in both halves of the window, the weaker half holding at least
+    `min_half_ratio` of the magnitude of the stronger, so a window only partly covered by
+    a tone does not count.
+
+    A digit is reported once it has lasted `min_tone_duration` seconds and was preceded by
+    at least `min_gap_duration` seconds without a tone. Durations are counted in windows,
+    with the resolution of half a block: a tone shorter than `min_tone_duration` is never
+    reported, whatever its onset, and one longer by a block always is. With the defaults,
+    tones under 25 ms are rejected and tones from 38 ms on are accepted, in line with the
+    ITU-T Q.24 limits of 40 ms for a valid digit. Event timestamps are the start of the
+    first window of the tone.
+
+    Pickled decoders carry only their stream state, so they can be passed to worker processes cheaply.
+
+    Example of usage :
+
+        decoder = DTMFStreamDecoder(8000)
+        for frame in frames:
+            for event in decoder.process(frame):
+                print(event.digit, event.start)
+    """
+
+    def __init__(self, sample_rate, block_duration=0.02, min_tone_duration=0.025, min_gap_duration=0.04,
+                 min_confidence=0.3, min_tone_share=0.1, max_twist_db=8.0, min_peak_ratio_db=4.0, min_half_ratio=0.4,
+                 min_level=1e-3):
+        self.sample_rate = sample_rate
+        self.hop_size = int(math.ceil(block_duration * sample_rate / 2 - 1e-9))
+        if self.hop_size < 1:
+            raise ValueError(f'detection block of {block_duration} s is empty at {sample_rate} Hz')
+        self.block_size = 2 * self.hop_size
+
+        # A clean tone of `length` samples fills windows starting over `length - 2 * min_half_ratio * hop_size`
+        # samples, so it covers at most as many windows as the hops in that span plus one
+        hops = min_tone_duration * sample_rate / self.hop_size - 2 * min_half_ratio
+        self.min_tone_windows = max(1, int(math.ceil(hops - 1e-9)) + 1)
+        hops = min_gap_duration * sample_rate / self.hop_size + 2 * min_half_ratio
+        self.min_gap_windows = max(0, int(math.ceil(hops - 1e-9)) - 1)
+        # Samples from the start of a tone's first window to the end of the window it is reported in
+        self.detection_delay = (self.min_tone_windows - 1) * self.hop_size + self.block_size
+
+        self.min_confidence = min_confidence
+        self.min_tone_share = min_tone_share
+        self.max_twist = 10 ** (max_twist_db / 10)
+        self.min_peak_ratio = 10 ** (min_peak_ratio_db / 10)
+        self.min_half_ratio = min_half_ratio
+        self.min_energy = min_level ** 2 * self.block_size
+
+        self.basis = get_goertzel_basis(sample_rate, self.hop_size)
+        # Phase of the terms of the second half-block relative to the start of the window
+        freqs = np.array(DTMF_LOW_FREQS + DTMF_HIGH_FREQS)
+        self.shift = np.exp(-2j * np.pi * freqs * self.hop_size / sample_rate)
+
+        self.reset()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['basis']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.basis = get_goertzel_basis(self.sample_rate, self.hop_size)
+
+    def reset(self):
+        self.terms = np.zeros(self.basis.shape[1], dtype=complex)
+        self.energy = 0.0
+        self.filled = 0
+        self.hop_start = 0
+        self.previous_terms = None
+        self.previous_energy = 0.0
+
+        # The stream is treated as starting after a long enough pause
+        self.current = None
+        self.run_start = 0
+        self.run_windows = self.min_gap_windows
+        self.run_confidence = 0.0
+        self.gap_before = 0
+        self.emitted = False
+
+    def process(self, chunk):
+        """
+        Feed the next chunk of samples and return the list of `DTMFEvent` it completed.
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        events = []
+        offset = 0
+        while offset < len(chunk):
+            take = min(self.hop_size - self.filled, len(chunk) - offset)
+            part = chunk[offset:offset + take]
+            self.terms += part @ self.basis[self.filled:self.filled + take]
+            self.energy += np.dot(part, part)
+            self.filled += take
+            offset += take
+
+            if self.filled == self.hop_size:
+                event = self._finish_hop()
+                if event is not None:
+                    events.append(event)
+        return events
+
+    def _classify_window(self, first, second, energy):
+        if energy < self.min_energy:
+            return None, 0.0
+
+        terms = first + self.shift * second
+        share = 2 * np.abs(terms) ** 2 / (self.block_size * energy)
+        n_low = len(DTMF_LOW_FREQS)
+        low_shares, high_shares = np.sort(share[:n_low]), np.sort(share[n_low:])
+        low, high = np.argmax(share[:n_low]), np.argmax(share[n_low:])
+        confidence = min(1.0, float(low_shares[-1] + high_shares[-1]))
+        if confidence < self.min_confidence or min(low_shares[-1], high_shares[-1]) < self.min_tone_share:
+            return None, confidence
+        if max(low_shares[-1], high_shares[-1]) > self.max_twist * min(low_shares[-1], high_shares[-1]):
+            return None, confidence
+        if (low_shares[-1] < self.min_peak_ratio * low_shares[-2]
+                or high_shares[-1] < self.min_peak_ratio * high_shares[-2]):
+            return None, confidence
+
+        halves = np.abs([first[[low, n_low + high]], second[[low, n_low + high]]])
+        if np.any(halves.min(axis=0) < self.min_half_ratio * halves.max(axis=0)):
+            return None, confidence
+        return DTMF_INDEX[(DTMF_LOW_FREQS[low], DTMF_HIGH_FREQS[high])], confidence
+
+    def _finish_hop(self):
+        first, first_energy = self.previous_terms, self.previous_energy
+        window_start = self.hop_start - self.hop_size
+
+        self.previous_terms, self.previous_energy = self.terms, self.energy
+        self.terms = np.zeros_like(self.terms)
+        self.energy = 0.0
+        self.filled = 0
+        self.hop_start += self.hop_size
+        if first is None:
+            return None
+
+        digit, confidence = self._classify_window(first, self.previous_terms, first_energy + self.previous_energy)
+        if digit == self.current:
+            self.run_windows += 1
+            self.run_confidence += confidence
+        else:
+            self.gap_before = self.run_windows if self.current is None else 0
+            self.current = digit
+            self.run_start = window_start
+            self.run_windows = 1
+            self.run_confidence = confidence
+            self.emitted = False
+
+        if (digit is None or self.emitted or self.run_windows < self.min_tone_windows
+                or self.gap_before < self.min_gap_windows):
+            return None
+
+        self.emitted = True
+        return DTMFEvent(digit, self.run_start / self.sample_rate, self.run_confidence / self.run_windows)
+
+
+def check_stream_decoder(sample_rates=(8000, 44100), min_tone_duration=0.025, digit='5', onsets=20):
+    """
+    Check that `DTMFStreamDecoder` rejects tones shorter than `min_tone_duration` and reports tones
+    longer than it by a block, for `onsets` alignments across a half-block.
+
+    Raises `ValueError` on the first clip decoded otherwise.
+    """
+    for sample_rate in sample_rates:
+        decoder = DTMFStreamDecoder(sample_rate, min_tone_duration=min_tone_duration)
+        min_length = int(math.ceil(min_tone_duration * sample_rate))
+        lengths = {length: [] for length in (min_length // 4, min_length // 2, min_length - decoder.hop_size // 2,
+                                             min_length - 1)}
+        lengths[min_length + decoder.block_size] = [digit]
+
+        pad = np.zeros(decoder.block_size * 5)
+        for length, expected in lengths.items():
+            tone = generate_signal(DTMF_TABLE[digit], np.arange(length) / sample_rate)
+            for onset in range(0, decoder.hop_size, max(1, decoder.hop_size // onsets)):
+                clip = np.concatenate((pad[:len(pad) - onset], tone, pad))
+                decoder.reset()
+                decoded = [event.digit for event in decoder.process(clip)]
+                if decoded != expected:
+                    raise ValueError(f'{length / sample_rate * 1e3:.1f} ms tone at {sample_rate} Hz with onset {onset} '
+                                     f'decoded as {decoded}, expected {expected}')
+
+
+def find_key(low, high):
+    """
+    Classify a pair of detected frequencies in Hz as a DTMF key, or return None.
+    """
+    key = DTMF_INDEX.get((DTMF_BANDS.get(int(round(low))), DTMF_BANDS.get(int(round(high)))))
+    if key is not None:
+        print('DTMF signal', key, 'received')
+    return key
 
 
 def read_input():
     arr = list(input())
-    return list(map(lambda i: DTMF_TABLE[int(i)], arr))
+    return list(map(lambda i: DTMF_TABLE[i.upper()], arr))
 
 
-def generate_signal(tones):
+def generate_signal(tones, time_axis=t):
     f1 = tones['high']
     f2 = tones['low']
-    x = np.sin(2 * np.pi * f1 * t) + np.sin(2 * np.pi * f2 * t)
+    x = np.sin(2 * np.pi * f1 * time_axis) + np.sin(2 * np.pi * f2 * time_axis)
     return x
 
 
 def apply_goertzel(signal):
-    freqs, results = goertzel(signal, sr, (697, 1209), (697, 1336), (697, 1477), (770, 1209), (770, 1336), (770, 1477),
-                              (852, 1209), (852, 1336), (852, 1477))
+    freqs, results = goertzel_vectorized(signal, sr, (DTMF_LOW_FREQS[0] * (1 - DTMF_TOLERANCE),
+                                                      DTMF_HIGH_FREQS[-1] * (1 + DTMF_TOLERANCE)))
     return freqs, results
 
 
 def draw_graph(x, y):
-    plt.plot(x, y)
-    plt.show()
+    fig, (ax,) = plotting.get_figure('graph')
+    plotting.plot(ax, x, y)
+    plotting.show(fig)
 
 
 def callback(tones):
@@ -135,13 +472,12 @@ def callback(tones):
     draw_graph(freqs, results)
 
     # 2
-    res = list(map(itemgetter(-1), results))
-    ind = np.argpartition(res, -4)[-4:]
-    arr = np.array(freqs)[ind]
+    res = np.array(list(map(itemgetter(-1), results)))
+    freqs = np.array(freqs)
+    is_high = freqs > DTMF_GROUP_SPLIT
+    arr = np.array([freqs[~is_high][np.argmax(res[~is_high])], freqs[is_high][np.argmax(res[is_high])]])
 
-    high = int(np.max(arr))
-    low = int(np.min(arr))
-    iterate_in_two_dimensional_vicinity(low, high, find_key)
+    find_key(np.min(arr), np.max(arr))
     return arr
 
 
@@ -165,8 +501,8 @@ def generate_am_signal(amp_c=1.0, amp_s=1.0, km=1.0, fc=10.0, fs=2.0):
     return amp_c * (1 + km * amp_s * np.cos(2 * math.pi * fs * t)) * np.cos(2 * math.pi * fc * t)
 
 
-def add_noise(signal):
-    noise = np.random.normal(0, B, signal.shape)
+def add_noise(signal, scale=B, rng=np.random):
+    noise = rng.normal(0, scale, signal.shape)
     noised_signal = signal + noise
     return noised_signal
 
@@ -179,12 +515,18 @@ def draw_noised_am_signal():
 
 
 def main():
-    tones = read_input()
-    list(map(callback, tones))
+    while True:
+        try:
+            tones = read_input()
+        except EOFError:
+            return
+        list(map(callback, tones))
 
-    draw_noised_am_signal()
+        draw_noised_am_signal()
 
-    main()
 
-
-main()
+if __name__ == '__main__':
+    check_goertzel()
+    check_stream_decoder()
+    # benchmark_goertzel()
+    main()
@@ -1,9 +1,24 @@
+import json
+import os
+import struct
+import wave
 import warnings
 import numpy as np
-import matplotlib.pyplot as plt
 import scipy.signal as signal
-import librosa
-import librosa.display
+import plotting
+import spectrogram
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter as timer
+from lazy import lazy_import
+
+librosa = lazy_import('librosa')
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
 
 warnings.filterwarnings("ignore")
 np.seterr(divide='ignore')
@@ -23,52 +38,246 @@ font = {
     'size': 4
 }
 
-plt.rc('font', **font)
-plt.rcParams['figure.dpi'] = 300
+plotting.set_rc('font', **font)
+plotting.set_rc('figure', dpi=300)
+
+
+def pcm_to_float(samples):
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128) / 128
+    if np.issubdtype(samples.dtype, np.integer):
+        return samples.astype(np.float32) / np.iinfo(samples.dtype).max
+    return samples.astype(np.float32, copy=False)
+
+
+class AudioSource(ABC):
+    """
+    Audio file read by frame ranges instead of being decoded into memory at once.
+
+    `read` returns float32 samples of a range, mono or `(channels, samples)`, and
+    `time_axis` the matching times, so neither has to exist for the whole file.
+    """
+
+    sample_rate = None
+    channels = 1
+    length = 0
+
+    @property
+    def duration(self):
+        return self.length / self.sample_rate
+
+    def limit(self, duration):
+        if duration is not None:
+            self.length = min(self.length, int(duration * self.sample_rate))
+        return self
+
+    def bounds(self, start, stop):
+        stop = self.length if stop is None else min(stop, self.length)
+        return min(start, stop), stop
+
+    @abstractmethod
+    def read(self, start=0, stop=None, mono=True):
+        pass
+
+    def times(self, index):
+        return np.asarray(index) / self.sample_rate
+
+    def time_axis(self, start=0, stop=None):
+        start, stop = self.bounds(start, stop)
+        return self.times(np.arange(start, stop))
+
+    def blocks(self, block_size=65536, start=0, stop=None, mono=True):
+        start, stop = self.bounds(start, stop)
+        for offset in range(start, stop, block_size):
+            yield self.read(offset, min(offset + block_size, stop), mono)
+
+
+class MemmapSource(AudioSource):
+    """
+    Uncompressed PCM samples memory-mapped from a file; ranges are converted to float32
+    only when read, and mono float32 data is returned without copying.
+    """
+
+    def __init__(self, path, dtype, sample_rate, channels=1, offset=0, length=None):
+        dtype = np.dtype(dtype)
+        available = (os.path.getsize(path) - offset) // (dtype.itemsize * channels)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.length = available if length is None else min(length, available)
+        self.data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(self.length, channels))
+
+    def read(self, start=0, stop=None, mono=True):
+        start, stop = self.bounds(start, stop)
+        samples = pcm_to_float(self.data[start:stop])
+        if mono:
+            return samples[:, 0] if self.channels == 1 else samples.mean(axis=1)
+        return samples.T
+
+
+class DecodedSource(AudioSource):
+    """
+    Compressed audio decoded range by range with `soundfile`, or with `librosa` when it is not installed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if soundfile is not None:
+            info = soundfile.info(path)
+            self.sample_rate, self.channels, self.length = info.samplerate, info.channels, info.frames
+        else:
+            self.sample_rate = librosa.get_samplerate(path)
+            self.length = int(librosa.get_duration(path=path) * self.sample_rate)
+
+    def read(self, start=0, stop=None, mono=True):
+        start, stop = self.bounds(start, stop)
+        if soundfile is not None:
+            with soundfile.SoundFile(self.path) as file:
+                file.seek(start)
+                samples = file.read(stop - start, dtype='float32', always_2d=True).T
+        else:
+            samples = librosa.load(self.path, sr=None, mono=False, offset=start / self.sample_rate,
+                                   duration=(stop - start) / self.sample_rate)[0]
+            samples = np.atleast_2d(samples)[:, :stop - start]
+        return samples.mean(axis=0) if mono else samples
+
+    def blocks(self, block_size=65536, start=0, stop=None, mono=True):
+        if soundfile is None:
+            yield from super().blocks(block_size, start, stop, mono)
+            return
+
+        start, stop = self.bounds(start, stop)
+        for block in soundfile.blocks(self.path, blocksize=block_size, start=start, stop=stop, dtype='float32',
+                                      always_2d=True):
+            yield block.mean(axis=1) if mono else block.T
+
+
+WAV_DTYPES = {
+    (1, 8): np.uint8,
+    (1, 16): '<i2',
+    (1, 32): '<i4',
+    (3, 32): '<f4',
+    (3, 64): '<f8',
+}
+
+
+def open_wav(path):
+    """
+    Memory-map the data chunk of a WAV file, or return None for encodings that cannot be mapped (e.g. 24-bit).
+    """
+    with open(path, 'rb') as file:
+        riff, _, wave_id = struct.unpack('<4sI4s', file.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            return None
+
+        fmt = None
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                return None
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                chunk = file.read(size + size % 2)
+                format_tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', chunk[:16])
+                if format_tag == 0xFFFE:
+                    format_tag = struct.unpack('<H', chunk[24:26])[0]
+                fmt = format_tag, channels, sample_rate, bits
+            elif chunk_id == b'data':
+                break
+            else:
+                file.seek(size + size % 2, os.SEEK_CUR)
+        offset = file.tell()
+
+    if fmt is None or (fmt[0], fmt[3]) not in WAV_DTYPES:
+        return None
+    format_tag, channels, sample_rate, bits = fmt
+    return MemmapSource(path, WAV_DTYPES[format_tag, bits], sample_rate, channels, offset,
+                        size // (bits // 8 * channels))
+
+
+def open_audio(path, duration=None, sample_rate=None, dtype='<i2', channels=1):
+    """
+    Open an audio file as an `AudioSource` limited to the first `duration` seconds.
+
+    WAV files and headerless `.raw`/`.pcm` files (described by `sample_rate`, `dtype` and
+    `channels`) are memory-mapped, other formats are decoded lazily.
+
+    Example of usage :
+
+        source = open_audio('lump.mp3', duration=60)
+        first_second = source.read(0, source.sample_rate)
+    """
+    extension = os.path.splitext(path)[1].lower()
+    source = None
+    if extension in ('.raw', '.pcm'):
+        source = MemmapSource(path, dtype, sample_rate, channels)
+    elif extension == '.wav':
+        source = open_wav(path)
+    if source is None:
+        source = DecodedSource(path)
+    return source.limit(duration)
+
 
 duration = 60
 
 data_dir = '/Volumes/dev/hse/media/audio/lump.mp3'
-audio, sfreq = librosa.load(data_dir, duration=duration)
-time = np.arange(0, len(audio)) / sfreq
 
+# Recording the filter functions work on by default, opened with `load_recording`
+source = None
+audio = None
+sfreq = Fs
+
+
+def load_recording(path=data_dir, seconds=duration):
+    """
+    Open the first `seconds` of a recording and make it the default signal of the filter functions.
+    """
+    global source, audio, sfreq
+    source = open_audio(path, duration=seconds)
+    audio, sfreq = source.read(), source.sample_rate
+    return audio
+
+
+def time(index):
+    """
+    Times of sample indices at `sfreq`, computed when a plot needs them.
+    """
+    return np.asarray(index) / sfreq
 
-def set_graph_params(subplot, title, xlabel, ylabel):
-    plt.subplot(subplot)
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
 
+def set_graph_params(ax, title, xlabel, ylabel):
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
 
-def draw_signal_and_spectrum(time, audio, sos=None, title=''):
-    order = 311
-    if sos is not None:
-        order = order + 100
 
-    set_graph_params(order, f'Сигнал {title}', 'Время, c', 'Амплитуда сигнала, В')
-    plt.plot(time, audio)
+def draw_signal_and_spectrum(time, audio, sos=None, title='', response=None):
+    # Multichannel and batched signals are previewed by their first row
+    if np.ndim(audio) > 1:
+        audio = audio[0]
 
-    order += 1
-    plt.subplot(order)
-    plt.magnitude_spectrum(audio, Fs=sfreq)
-    set_graph_params(order, 'Спект сигнала', 'Частота, Гц', 'Амплитуда сигнала, В')
+    fig, axes = plotting.get_figure('signal_and_spectrum', 3 if sos is None else 4)
 
-    order += 1
-    plt.subplot(order)
-    S_full, phase = librosa.magphase(librosa.stft(audio))
+    set_graph_params(axes[0], f'Сигнал {title}', 'Время, c', 'Амплитуда сигнала, В')
+    plotting.plot_envelope(axes[0], time, audio)
+
+    plotting.magnitude_spectrum(axes[1], audio, Fs=sfreq)
+    set_graph_params(axes[1], 'Спект сигнала', 'Частота, Гц', 'Амплитуда сигнала, В')
+
+    S_full = spectrogram.stft_magnitude(audio)
     idx = slice(*librosa.time_to_frames([0, duration], sr=sfreq))
-    librosa.display.specshow(librosa.amplitude_to_db(S_full[:, idx], ref=np.max), y_axis='log', x_axis='time', sr=sfreq)
-    set_graph_params(order, 'Спектрограмма сигнала', 'Время, с', 'Частота сигнала, Гц')
+    plotting.clear_images(axes[2])
+    librosa.display.specshow(librosa.amplitude_to_db(S_full[:, idx], ref=np.max), y_axis='log', x_axis='time', sr=sfreq,
+                             ax=axes[2])
+    set_graph_params(axes[2], 'Спектрограмма сигнала', 'Время, с', 'Частота сигнала, Гц')
 
     if sos is None:
-        plt.show()
+        plotting.show(fig)
         return
 
-    order += 1
-    set_graph_params(order, 'AЧХ', 'Угловая частота, рад/с', 'Коэффициент передачи, дБ')
-    w, h = signal.sosfreqz(sos, worN=1500)
-    plt.plot(w / np.pi, 20 * np.log10(abs(h)))
-    plt.show()
+    set_graph_params(axes[3], 'AЧХ', 'Угловая частота, рад/с', 'Коэффициент передачи, дБ')
+    w, h = signal.sosfreqz(sos, worN=1500) if response is None else response
+    plotting.plot(axes[3], w / np.pi, 20 * np.log10(abs(h)))
+    plotting.show(fig)
 
 
 def get_freqs(btype, lowcut, highcut, fs):
@@ -83,12 +292,105 @@ def get_freqs(btype, lowcut, highcut, fs):
     return [lowcut, highcut]
 
 
-def butter(btype='lowpass', sig=audio, lowcut=1, highcut=3000, order=10, fs=Fs):
+FILTER_DESIGNS = {
+    'butter': lambda order, freqs, btype, fs: signal.butter(order, freqs, btype, analog=False, output='sos', fs=fs),
+    'cheby1': lambda order, freqs, btype, fs: signal.cheby1(order, 5, freqs, btype, analog=False, output='sos', fs=fs),
+    'cheby2': lambda order, freqs, btype, fs: signal.cheby2(order, 40, freqs, btype, analog=False, output='sos', fs=fs),
+    'ellip': lambda order, freqs, btype, fs: signal.ellip(order, 5, 40, freqs, btype, analog=False, output='sos', fs=fs),
+}
+
+sos_cache = OrderedDict()
+sos_cache_size = 256
+sos_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def design_sos(ftype, btype, lowcut, highcut, order, fs):
+    """
+    Return the second-order sections of a `FILTER_DESIGNS` filter, designing each configuration only once.
+
+    Designs are kept in an LRU cache of `sos_cache_size` entries shared by all callers.
+    """
+    key = (ftype, btype, lowcut, highcut, order, fs)
+    if key in sos_cache:
+        sos_cache_stats['hits'] += 1
+        sos_cache.move_to_end(key)
+        return sos_cache[key]
+
+    sos_cache_stats['misses'] += 1
+    sos = FILTER_DESIGNS[ftype](order, get_freqs(btype, lowcut, highcut, fs), btype, fs)
+    sos_cache[key] = sos
+    if len(sos_cache) > sos_cache_size:
+        sos_cache.popitem(last=False)
+    return sos
+
+
+def save_sos_cache(path):
+    """
+    Persist the designed filters to an `.npz` file.
+    """
+    keys = [json.dumps(key) for key in sos_cache]
+    np.savez(path, keys=np.array(keys), **{f'sos_{i}': sos for i, sos in enumerate(sos_cache.values())})
+
+
+def load_sos_cache(path):
+    """
+    Add the filters saved by `save_sos_cache` to the cache.
+    """
+    with np.load(path) as data:
+        for i, key in enumerate(data['keys']):
+            sos_cache[tuple(json.loads(str(key)))] = data[f'sos_{i}']
+
+
+def filter_batch(sos, sig, workers=None):
+    """
+    Filter a 1-D signal or a `(channels, samples)` / `(batch, samples)` matrix along its last axis.
+
+    All rows go through one vectorized `sosfilt` call, or with `workers` are split into
+    that many row blocks filtered on a thread pool, as `sosfilt` releases the GIL.
+    """
+    sig = np.asarray(sig)
+    if sig.ndim < 2 or not workers or workers < 2:
+        return signal.sosfilt(sos, sig, axis=-1)
+
+    bounds = np.linspace(0, len(sig), min(workers, len(sig)) + 1).astype(int)
+    filtered = np.empty(sig.shape, dtype=np.result_type(sos, sig, np.float64))
+
+    def filter_rows(start, stop):
+        filtered[start:stop] = signal.sosfilt(sos, sig[start:stop], axis=-1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(filter_rows, bounds[:-1], bounds[1:]))
+    return filtered
+
+
+def benchmark_filter_batch(channel_counts=(2, 8, 64), duration=10, workers=4, fs=Fs):
+    """
+    Compare a Python loop over 1-D `sosfilt` calls with `filter_batch` on random multichannel signals.
+    """
+    sos = design_sos('cheby1', 'bandstop', 100, 1000, 4, fs)
+    rng = np.random.default_rng(0)
+    for channels in channel_counts:
+        sig = rng.normal(size=(channels, int(duration * fs)))
+
+        start = timer()
+        expected = np.array([signal.sosfilt(sos, row) for row in sig])
+        timings = [timer() - start]
+        for run_workers in (None, workers):
+            start = timer()
+            filtered = filter_batch(sos, sig, run_workers)
+            timings.append(timer() - start)
+            assert np.array_equal(filtered, expected)
+
+        print(f'{channels} x {duration} s: loop {timings[0]:.3f} s, vectorized {timings[1]:.3f} s, '
+              f'{workers} threads {timings[2]:.3f} s')
+
+
+def butter(btype='lowpass', sig=None, lowcut=1, highcut=3000, order=10, fs=Fs):
     title = f'{btype} butter'
-    freqs = get_freqs(btype, lowcut, highcut, fs)
+    sig = audio if sig is None else sig
 
-    sos = signal.butter(order, freqs, btype, analog=False, output='sos', fs=fs)
-    filtered = signal.sosfilt(sos, sig)
+    sos = design_sos('butter', btype, lowcut, highcut, order, fs)
+    filtered = filter_batch(sos, sig)
     draw_signal_and_spectrum(time, filtered, sos, title)
 
     return filtered
@@ -96,48 +398,164 @@ def butter(btype='lowpass', sig=audio, lowcut=1, highcut=3000, order=10, fs=Fs):
     #     librosa.output.write_wav(f'/Volumes/dev/hse/media/audio/test.wav', filtered, sfreq)
 
 
-def cheby1(btype='lowpass', sig=audio, lowcut=1, highcut=3000, order=4, fs=Fs):
+def cheby1(btype='lowpass', sig=None, lowcut=1, highcut=3000, order=4, fs=Fs):
     title = f'{btype} chebyshev type I'
-    freqs = get_freqs(btype, lowcut, highcut, fs)
+    sig = audio if sig is None else sig
 
-    sos = signal.cheby1(order, 5, freqs, btype, analog=False, output='sos', fs=fs)
-    filtered = signal.sosfilt(sos, sig)
+    sos = design_sos('cheby1', btype, lowcut, highcut, order, fs)
+    filtered = filter_batch(sos, sig)
     draw_signal_and_spectrum(time, filtered, sos, title)
 
     return filtered
 
 
-def cheby2(btype='lowpass', sig=audio, lowcut=1, highcut=3000, order=4, fs=Fs):
+def cheby2(btype='lowpass', sig=None, lowcut=1, highcut=3000, order=4, fs=Fs):
     title = f'{btype} chebyshev type II'
-    freqs = get_freqs(btype, lowcut, highcut, fs)
+    sig = audio if sig is None else sig
 
-    sos = signal.cheby2(order, 40, freqs, btype, analog=False, output='sos', fs=fs)
-    filtered = signal.sosfilt(sos, sig)
+    sos = design_sos('cheby2', btype, lowcut, highcut, order, fs)
+    filtered = filter_batch(sos, sig)
     draw_signal_and_spectrum(time, filtered, sos, title)
 
     return filtered
 
 
-def ellip(btype='lowpass', sig=audio, lowcut=1, highcut=3000, order=4, fs=Fs):
+def ellip(btype='lowpass', sig=None, lowcut=1, highcut=3000, order=4, fs=Fs):
     title = f'{btype} elliptic filter'
-    freqs = get_freqs(btype, lowcut, highcut, fs)
+    sig = audio if sig is None else sig
 
-    sos = signal.ellip(order, 5, 40, freqs, btype, analog=False, output='sos', fs=fs)
-    filtered = signal.sosfilt(sos, sig)
+    sos = design_sos('ellip', btype, lowcut, highcut, order, fs)
+    filtered = filter_batch(sos, sig)
     draw_signal_and_spectrum(time, filtered, sos, title)
 
     return filtered
 
 
-filters = [butter]
+def read_blocks(path, block_size=65536):
+    """
+    Open an audio file for block reading.
 
-draw_signal_and_spectrum(time, audio)
+    Returns the sample rate and a generator of mono float32 blocks of `block_size` samples,
+    read from an `open_audio` source.
+    """
+    source = open_audio(path)
+    return source.sample_rate, source.blocks(block_size)
 
-# list(map(lambda f: list(map(f, list(Btypes))), filters))
 
-filtered = cheby1('bandstop', audio, 100, 1000)
-# b = copy.deepcopy(filtered)
-filtered2 = cheby1('bandstop', filtered, 4000, 5000)
+def write_blocks(blocks, path, sample_rate):
+    """
+    Write mono float blocks to a WAV file as they arrive: float samples with `soundfile`, 16-bit PCM otherwise.
+    """
+    if soundfile is not None:
+        with soundfile.SoundFile(path, 'w', sample_rate, 1, subtype='FLOAT') as output:
+            for block in blocks:
+                output.write(block)
+        return
+
+    with wave.open(path, 'wb') as output:
+        output.setnchannels(1)
+        output.setsampwidth(2)
+        output.setframerate(sample_rate)
+        for block in blocks:
+            output.writeframes((np.clip(block, -1, 1) * 32767).astype('<i2').tobytes())
+
+
+def stream_filter(blocks, sos):
+    """
+    Filter consecutive blocks of a signal, carrying the filter state from block to block.
+
+    Blocks are filtered along their last axis, so `(channels, samples)` blocks are supported.
+    The yielded blocks concatenate to exactly `signal.sosfilt(sos, sig)` of the whole signal.
+    """
+    zi = None
+    for block in blocks:
+        if zi is None:
+            zi = np.zeros((sos.shape[0],) + np.shape(block)[:-1] + (2,))
+        filtered, zi = signal.sosfilt(sos, block, axis=-1, zi=zi)
+        yield filtered
+
+
+def append_spectrogram(blocks, store):
+    """
+    Pass `blocks` through while adding their STFT frames to a `spectrogram.SpectrogramStore`.
+    """
+    for block in blocks:
+        store.append(block)
+        yield block
+    store.finish()
+
+
+def stream_filter_file(input_path, output_path, ftype='butter', btype='lowpass', lowcut=1, highcut=3000, order=4,
+                       block_size=65536, spectrogram_path=None):
+    """
+    Filter an audio file of any length block by block, keeping memory use independent of its duration.
+
+    With `spectrogram_path` the STFT magnitudes of the filtered signal are written there as well.
+    """
+    sample_rate, blocks = read_blocks(input_path, block_size)
+    sos = design_sos(ftype, btype, lowcut, highcut, order, sample_rate)
+    filtered = stream_filter(blocks, sos)
+    if spectrogram_path is not None:
+        filtered = append_spectrogram(filtered, spectrogram.SpectrogramStore(spectrogram_path))
+    write_blocks(filtered, output_path, sample_rate)
+
+
+class FilterChain:
+    """
+    Cascade of `FILTER_DESIGNS` filters run as a single filter.
+
+    The second-order sections of every stage are stacked, so the whole chain is applied
+    in one `sosfilt` (or zero-phase `sosfiltfilt`) pass and its frequency response is
+    computed once.
+
+    Example of usage :
+
+        chain = FilterChain(Fs).add('cheby1', 'bandstop', 100, 1000).add('cheby1', 'bandstop', 4000, 5000)
+        filtered = chain.apply(audio)
+    """
+
+    def __init__(self, fs=Fs):
+        self.fs = fs
+        self.stages = []
+        self.sos = np.zeros((0, 6))
+        self.response = None
+
+    def add(self, ftype, btype='lowpass', lowcut=1, highcut=3000, order=4):
+        self.stages.append((ftype, btype, lowcut, highcut, order))
+        self.sos = np.vstack([self.sos, design_sos(ftype, btype, lowcut, highcut, order, self.fs)])
+        self.response = None
+        return self
+
+    @property
+    def title(self):
+        return ', '.join(f'{btype} {ftype} {lowcut}-{highcut}' for ftype, btype, lowcut, highcut, _ in self.stages)
+
+    def apply(self, sig, zero_phase=False, workers=None):
+        if zero_phase:
+            return signal.sosfiltfilt(self.sos, sig, axis=-1)
+        return filter_batch(self.sos, sig, workers)
+
+    def frequency_response(self, worN=1500):
+        if self.response is None or len(self.response[0]) != worN:
+            self.response = signal.sosfreqz(self.sos, worN=worN)
+        return self.response
+
+    def draw(self, sig, zero_phase=False):
+        filtered = self.apply(sig, zero_phase)
+        draw_signal_and_spectrum(time, filtered, self.sos, self.title, self.frequency_response())
+        return filtered
+
+
+if __name__ == '__main__':
+    load_recording()
+    filters = [butter]
+
+    draw_signal_and_spectrum(time, audio)
+
+    # list(map(lambda f: list(map(f, list(Btypes))), filters))
+
+    chain = FilterChain().add('cheby1', 'bandstop', 100, 1000).add('cheby1', 'bandstop', 4000, 5000)
+    filtered = chain.draw(audio)
 
 # Input parameters
 # fs = 10
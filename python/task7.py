@@ -1,11 +1,25 @@
+import hashlib
+import os
+import tracemalloc
 import warnings
 import numpy as np
-import IPython.display as ipd
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import librosa
+from collections import namedtuple
+import plotting
+import spectral
+import spectrogram
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter as timer
+from PIL import Image
 from scipy import signal, interpolate
-from scipy.fftpack import fft, ifft, rfftfreq
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import splu
+from scipy.fftpack import rfftfreq
+from lazy import lazy_import
+
+ipd = lazy_import('IPython.display')
+librosa = lazy_import('librosa')
+plt = lazy_import('matplotlib.pyplot')
+animation = lazy_import('matplotlib.animation')
 
 warnings.filterwarnings("ignore")
 font = {
@@ -14,21 +28,29 @@ font = {
     'size': 7
 }
 
-plt.rc('font', **font)
-plt.rcParams['figure.dpi'] = 300
+plotting.set_rc('font', **font)
+plotting.set_rc('figure', dpi=300)
 
 DTMF_TABLE = {
-    1: {'high': 1209, 'low': 697},
-    2: {'high': 1336, 'low': 697},
-    3: {'high': 1477, 'low': 697},
-
-    4: {'high': 1209, 'low': 770},
-    5: {'high': 1336, 'low': 770},
-    6: {'high': 1477, 'low': 770},
-
-    7: {'high': 1209, 'low': 852},
-    8: {'high': 1336, 'low': 852},
-    9: {'high': 1477, 'low': 852},
+    '1': {'high': 1209, 'low': 697},
+    '2': {'high': 1336, 'low': 697},
+    '3': {'high': 1477, 'low': 697},
+    'A': {'high': 1633, 'low': 697},
+
+    '4': {'high': 1209, 'low': 770},
+    '5': {'high': 1336, 'low': 770},
+    '6': {'high': 1477, 'low': 770},
+    'B': {'high': 1633, 'low': 770},
+
+    '7': {'high': 1209, 'low': 852},
+    '8': {'high': 1336, 'low': 852},
+    '9': {'high': 1477, 'low': 852},
+    'C': {'high': 1633, 'low': 852},
+
+    '*': {'high': 1209, 'low': 941},
+    '0': {'high': 1336, 'low': 941},
+    '#': {'high': 1477, 'low': 941},
+    'D': {'high': 1633, 'low': 941},
 }
 
 titles = ['Децимация, КИХ фильтр', 'Прореживание, КИХ фильтр', 'Децимация, БИХ фильтр', 'Прореживание, БИХ фильтр']
@@ -37,6 +59,12 @@ Fs = 100000
 t = 0.4
 time = np.linspace(0, t, int(t * Fs), endpoint=False)
 
+polyphase_taps = {}
+decimation_plans = {}
+interpolators = {}
+
+DecimationPlan = namedtuple('DecimationPlan', ['factors', 'taps', 'ops_per_sample'])
+
 
 def generate_signal(tone):
     low_freq = tone['low']
@@ -46,59 +74,50 @@ def generate_signal(tone):
     return sig, five_periods
 
 
-def set_graph_params(subplot, title, xlabel, ylabel, xlim=None, ylim=None):
-    plt.subplot(subplot)
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
+def set_graph_params(ax, title, xlabel, ylabel, xlim=None, ylim=None):
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
     if xlim is not None:
-        plt.xlim(xlim)
+        ax.set_xlim(xlim)
     if ylim is not None:
-        plt.ylim(ylim)
+        ax.set_ylim(ylim)
 
 
-def draw_spectrum(sig, order=111, title='', Fs=Fs, xlim=[650, 1500]):
-    plt.magnitude_spectrum(sig, Fs)
-    set_graph_params(order, f'Спект, {title}', 'Частота, Гц', 'Амплитуда, В', xlim)
+def draw_spectrum(sig, ax, title='', Fs=Fs, xlim=[650, 1500]):
+    plotting.magnitude_spectrum(ax, sig, Fs)
+    set_graph_params(ax, f'Спект, {title}', 'Частота, Гц', 'Амплитуда, В', xlim)
 
 
 def draw_processed_signal_spectrums(processed_signals, downsampling_factor):
     (decimated_sig_fir, resampled_sig_fir, decimated_signal_iir, resampled_signal_iir, _) = processed_signals
 
-    plt.suptitle(f'Коэффициента выброса значений {downsampling_factor}', y=1, fontweight='semibold')
-
-    order = 411
-    draw_spectrum(decimated_sig_fir, order, 'Прореживание, КИХ фильтр')
-
-    order += 1
-    draw_spectrum(resampled_sig_fir, order, 'Прореживание, БИХ фильтр')
-
-    order += 1
-    draw_spectrum(decimated_signal_iir, order, 'Децимация, КИХ фильтр')
+    fig, axes = plotting.get_figure('processed_signal_spectrums', 4)
+    fig.suptitle(f'Коэффициента выброса значений {downsampling_factor}', y=1, fontweight='semibold')
 
-    order += 1
-    draw_spectrum(resampled_signal_iir, order, 'Децимация, БИХ фильтр')
+    draw_spectrum(decimated_sig_fir, axes[0], 'Прореживание, КИХ фильтр')
+    draw_spectrum(resampled_sig_fir, axes[1], 'Прореживание, БИХ фильтр')
+    draw_spectrum(decimated_signal_iir, axes[2], 'Децимация, КИХ фильтр')
+    draw_spectrum(resampled_signal_iir, axes[3], 'Децимация, БИХ фильтр')
 
-    plt.show()
+    plotting.show(fig)
 
 
 def draw_signal_and_spectrum(time, sig, xlim, title=''):
-    order = 311
+    fig, axes = plotting.get_figure('signal_and_spectrum', 3)
 
-    set_graph_params(order, f'Тон {title}', 'Время, c', 'Амплитуда сигнала, В', [0, xlim])
-    plt.plot(time, sig)
+    set_graph_params(axes[0], f'Тон {title}', 'Время, c', 'Амплитуда сигнала, В', [0, xlim])
+    plotting.plot_envelope(axes[0], time, sig)
 
-    order += 1
-    plt.subplot(order)
-    plt.magnitude_spectrum(sig, Fs=Fs)
-    set_graph_params(order, 'Спект тона', 'Частота, Гц', 'Амплитуда, В', [650, 1500])
+    plotting.magnitude_spectrum(axes[1], sig, Fs=Fs)
+    set_graph_params(axes[1], 'Спект тона', 'Частота, Гц', 'Амплитуда, В', [650, 1500])
 
-    order += 1
-    set_graph_params(order, 'Тональный набор', 'Время, c', 'Частота, Гц', ylim=[650, 1600])
-    f, t, Sxx = signal.spectrogram(sig, Fs)
-    plt.pcolormesh(t, f, Sxx)
+    set_graph_params(axes[2], 'Тональный набор', 'Время, c', 'Частота, Гц', ylim=[650, 1600])
+    f, t, Sxx = spectrogram.spectrogram(sig, Fs)
+    plotting.clear_images(axes[2])
+    axes[2].pcolormesh(t, f, Sxx)
 
-    plt.show()
+    plotting.show(fig)
 
 
 def draw_processed_signals(processed_signals, five_periods, downsampling_factor, tone):
@@ -106,149 +125,519 @@ def draw_processed_signals(processed_signals, five_periods, downsampling_factor,
      decimated_signal_iir, resampled_signal_iir,
      decimated_time) = processed_signals
 
-    plt.suptitle(f'Тон {tone}, коэффициента выброса значений {downsampling_factor}', y=1, fontweight='semibold')
+    fig, axes = plotting.get_figure('processed_signals', 4)
+    fig.suptitle(f'Тон {tone}, коэффициента выброса значений {downsampling_factor}', y=1, fontweight='semibold')
 
-    order = 411
+    set_graph_params(axes[0], 'Прореживание, КИХ фильтр', 'Время, c', 'Амплитуда сигнала, В', [0, five_periods])
+    plotting.plot_envelope(axes[0], decimated_time, decimated_sig_fir)
 
-    set_graph_params(order, 'Прореживание, КИХ фильтр', 'Время, c', 'Амплитуда сигнала, В', [0, five_periods])
-    plt.plot(decimated_time, decimated_sig_fir)
+    set_graph_params(axes[1], 'Прореживание, БИХ фильтр', 'Время, c', 'Амплитуда сигнала, В')
+    plotting.plot_envelope(axes[1], decimated_time, decimated_signal_iir)
 
-    order += 1
-    set_graph_params(order, 'Прореживание, БИХ фильтр', 'Время, c', 'Амплитуда сигнала, В')
-    plt.plot(decimated_time, decimated_signal_iir)
+    set_graph_params(axes[2], 'Децимация, КИХ фильтр', 'Время, c', 'Амплитуда сигнала, В', [0, five_periods])
+    plotting.plot_envelope(axes[2], time, resampled_sig_fir)
 
-    order += 1
-    set_graph_params(order, 'Децимация, КИХ фильтр', 'Время, c', 'Амплитуда сигнала, В', [0, five_periods])
-    plt.plot(time, resampled_sig_fir)
+    set_graph_params(axes[3], 'Децимация, БИХ фильтр', 'Время, c', 'Амплитуда сигнала, В')
+    plotting.plot_envelope(axes[3], time, resampled_signal_iir)
 
-    order += 1
-    set_graph_params(order, 'Децимация, БИХ фильтр', 'Время, c', 'Амплитуда сигнала, В')
-    plt.plot(time, resampled_signal_iir)
-
-    plt.show()
+    plotting.show(fig)
 
 
 def draw_interpolated_signal(sig, time, decimated_time, downsampling_factor):
-    plt.suptitle(f'Коэффициента выброса значений {downsampling_factor}', y=1, fontweight='semibold')
-
-    order = 211
+    fig, axes = plotting.get_figure('interpolated_signal', 2)
+    fig.suptitle(f'Коэффициента выброса значений {downsampling_factor}', y=1, fontweight='semibold')
 
-    tck = interpolate.splrep(time, sig)
-    set_graph_params(order, 'Сигнал', 'Время, c', 'Амплитуда сигнала, В')
-    plt.plot(time, sig)
+    set_graph_params(axes[0], 'Сигнал', 'Время, c', 'Амплитуда сигнала, В')
+    plotting.plot_envelope(axes[0], time, sig)
 
-    order += 1
-    set_graph_params(order, 'Интерполированный сигнал', 'Время, c', 'Амплитуда сигнала, В')
-    interpolated = interpolate.splev(decimated_time, tck)
-    plt.plot(decimated_time, interpolated)
+    set_graph_params(axes[1], 'Интерполированный сигнал', 'Время, c', 'Амплитуда сигнала, В')
+    interpolated = get_interpolator(time, decimated_time)(sig)
+    plotting.plot_envelope(axes[1], decimated_time, interpolated)
 
     librosa.output.write_wav(f'/Volumes/dev/hse/media/audio/interpolated_{downsampling_factor}.wav', interpolated, Fs)
 
-    plt.show()
-
-
-def process_signals(sig, downsampling_factor, N, ftype):
-    decimated_sig = signal.decimate(sig, downsampling_factor, N, ftype=ftype)
-    resampled_sig = signal.resample(decimated_sig, num=int(len(sig)))
+    plotting.show(fig)
+
+
+def get_polyphase_taps(downsampling_factor):
+    """
+    Anti-aliasing FIR taps of `resample_poly` for a factor, designed once per factor.
+    """
+    if downsampling_factor not in polyphase_taps:
+        polyphase_taps[downsampling_factor] = signal.firwin(20 * downsampling_factor + 1, 1. / downsampling_factor,
+                                                            window=('kaiser', 5.0))
+    return polyphase_taps[downsampling_factor]
+
+
+def ordered_factorizations(n, max_stages):
+    """
+    Every way to write `n` as an ordered product of at most `max_stages` factors greater than one.
+    """
+    if n == 1:
+        yield ()
+        return
+    if max_stages == 0:
+        return
+    for factor in range(2, n + 1):
+        if n % factor == 0:
+            for rest in ordered_factorizations(n // factor, max_stages - 1):
+                yield (factor,) + rest
+
+
+def design_decimation_stages(factors, passband=0.8, ripple_db=60):
+    """
+    FIR taps for every stage of a decimation cascade.
+
+    All stages keep the final band of interest, `passband` of the output Nyquist frequency,
+    and only reject what would alias into it, so early stages get wide transition bands and short filters.
+    """
+    total_factor = np.prod(factors)
+    passband_edge = passband / total_factor
+    taps = []
+    rate = 2.
+    for factor in factors:
+        rate /= factor
+        stopband_edge = rate - passband_edge
+        numtaps, beta = signal.kaiserord(ripple_db, (stopband_edge - passband_edge) * 2 / (rate * factor))
+        cutoff = (passband_edge + stopband_edge) / (rate * factor)
+        taps.append(signal.firwin(numtaps | 1, cutoff, window=('kaiser', beta)))
+    return taps
+
+
+def count_ops_per_sample(factors, taps):
+    """
+    Multiply-accumulate operations per output sample of a polyphase decimation cascade.
+    """
+    return int(sum(len(stage_taps) * np.prod(factors[i + 1:], dtype=int) for i, stage_taps in enumerate(taps)))
+
+
+def plan_decimation(downsampling_factor, max_stages=3, passband=0.8, ripple_db=60):
+    """
+    Split a decimation factor into the cascade of stages with the fewest operations per output sample.
+
+    Plans are cached per factor and specification.
+    """
+    key = (downsampling_factor, max_stages, passband, ripple_db)
+    if key not in decimation_plans:
+        best = None
+        for factors in ordered_factorizations(downsampling_factor, max_stages):
+            taps = design_decimation_stages(factors, passband, ripple_db)
+            plan = DecimationPlan(factors, taps, count_ops_per_sample(factors, taps))
+            if best is None or plan.ops_per_sample < best.ops_per_sample:
+                best = plan
+        decimation_plans[key] = best
+    return decimation_plans[key]
+
+
+def decimate_cascade(sig, downsampling_factor, max_stages=3):
+    """
+    Decimate `sig` through the stages of `plan_decimation`, each run as a polyphase filter.
+    """
+    for factor, taps in zip(*plan_decimation(downsampling_factor, max_stages)[:2]):
+        sig = signal.resample_poly(sig, 1, factor, window=taps)
+    return sig
+
+
+def process_signals(sig, downsampling_factor, N, ftype, mode='fft'):
+    """
+    Downsample `sig` and bring it back to the original length.
+
+    In the `fft` mode the signal is decimated with `signal.decimate` and upsampled with the
+    FFT-based `signal.resample`. The `polyphase` mode upsamples with `resample_poly` and, for
+    the FIR variant, decimates with it as well, both using the cached `get_polyphase_taps`.
+    The `cascade` mode decimates the FIR variant through the stages of `plan_decimation`
+    and upsamples like the `polyphase` mode.
+    """
+    if mode == 'cascade' and ftype == 'fir':
+        decimated_sig = decimate_cascade(sig, downsampling_factor)
+    elif mode == 'polyphase' and ftype == 'fir':
+        decimated_sig = signal.resample_poly(sig, 1, downsampling_factor, window=get_polyphase_taps(downsampling_factor))
+    else:
+        decimated_sig = signal.decimate(sig, downsampling_factor, N, ftype=ftype)
+
+    if mode in ('polyphase', 'cascade'):
+        resampled_sig = signal.resample_poly(decimated_sig, downsampling_factor, 1,
+                                             window=get_polyphase_taps(downsampling_factor))[:len(sig)]
+    else:
+        resampled_sig = signal.resample(decimated_sig, num=int(len(sig)))
     return decimated_sig, resampled_sig
 
 
-def get_processed_signals(sig, downsampling_factor=5):
+def get_processed_signals(sig, downsampling_factor=5, mode='fft'):
     n = 29
     N_fir = 50 - n
     N_iir = 30 - n
 
-    decimated_sig_fir, resampled_sig_fir = process_signals(sig, downsampling_factor, N_fir, ftype='fir')
-    decimated_signal_iir, resampled_signal_iir = process_signals(sig, downsampling_factor, N_iir, ftype='iir')
+    decimated_sig_fir, resampled_sig_fir = process_signals(sig, downsampling_factor, N_fir, 'fir', mode)
+    decimated_signal_iir, resampled_signal_iir = process_signals(sig, downsampling_factor, N_iir, 'iir', mode)
 
     decimated_time = signal.decimate(time, downsampling_factor)
     return decimated_sig_fir, resampled_sig_fir, decimated_signal_iir, resampled_signal_iir, decimated_time
 
 
-def create_animation(sig, idx=0):
-    fig, ax = plt.subplots()
-
-    ims = []
-    for downspamling_factor in range(2, 51):
-        processed_signals = get_processed_signals(sig, downspamling_factor)
-
-        processed_signal = processed_signals[idx]
-
-        decimated_time = time if idx % 2 else processed_signals[-1]
-
-        im, = ax.plot(decimated_time, processed_signal)
-        title = ax.text(0.5, 1.05, f"{titles[idx]}, коэф. выброса значений {downspamling_factor}",
-                        size=plt.rcParams["axes.titlesize"],
-                        ha="center", transform=ax.transAxes, )
-        ims.append([im, title])
-
-    ani = animation.ArtistAnimation(fig, ims)
-
-    animation_name = f'{idx} анимация - Сигнал, {titles[idx]}'
-    ani.save(f'./animation/{animation_name}.gif', writer='imagemagick', fps=2.5, dpi=100)
-    print(f'{animation_name} создана')
-    plt.show()
+class Interpolator:
+    """
+    Interpolation of signals sampled on the `source` grid at the `target` points.
+
+    Everything that depends only on the two grids is built once: a sparse weight matrix
+    for the `linear` and `sinc` (Lanczos windowed sinc, `half_width` lobes) kernels, the
+    factorized collocation matrix and B-spline basis for `cubic`, which gives the same
+    result as `splrep`/`splev`. `polyphase` upsamples with `resample_poly` and expects the
+    source samples to lie on every `len(target) // len(source)`-th target point.
+    Calling the interpolator evaluates every row of a `(variants, samples)` array at once.
+
+    Example of usage :
+
+        interpolator = Interpolator(decimated_time, time, 'cubic')
+        interpolated_fir, interpolated_iir = interpolator(np.vstack([decimated_sig_fir, decimated_sig_iir]))
+    """
+
+    kernels = ('linear', 'cubic', 'sinc', 'polyphase')
+
+    def __init__(self, source, target, kernel='cubic', half_width=4):
+        if kernel not in self.kernels:
+            raise ValueError(f'Unknown interpolation kernel {kernel!r}, expected one of {self.kernels}')
+        source, target = np.asarray(source, dtype=np.float64), np.asarray(target, dtype=np.float64)
+        self.kernel = kernel
+        self.length = len(target)
+
+        if kernel == 'cubic':
+            knots = np.r_[(source[0],) * 4, source[2:-2], (source[-1],) * 4]
+            self.solver = splu(interpolate.BSpline.design_matrix(source, knots, 3).tocsc())
+            self.matrix = interpolate.BSpline.design_matrix(target, knots, 3, extrapolate=True).tocsr()
+        elif kernel == 'linear':
+            left = np.clip(np.searchsorted(source, target, side='right') - 1, 0, len(source) - 2)
+            weight = (target - source[left]) / (source[left + 1] - source[left])
+            self.matrix = self.weight_matrix(np.stack([left, left + 1], axis=1),
+                                             np.stack([1 - weight, weight], axis=1), len(source))
+        elif kernel == 'sinc':
+            position = np.interp(target, source, np.arange(len(source)))
+            columns = np.floor(position)[:, None].astype(int) + np.arange(1 - half_width, half_width + 1)
+            distance = position[:, None] - columns
+            weights = np.sinc(distance) * np.sinc(distance / half_width)
+            self.matrix = self.weight_matrix(np.clip(columns, 0, len(source) - 1),
+                                             weights / weights.sum(axis=1, keepdims=True), len(source))
+        else:
+            self.factor = max(int(round(len(target) / len(source))), 1)
+
+    def weight_matrix(self, columns, weights, source_length):
+        rows = np.repeat(np.arange(self.length), columns.shape[1])
+        return csr_matrix((weights.ravel(), (rows, columns.ravel())), shape=(self.length, source_length))
+
+    def __call__(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if self.kernel == 'polyphase':
+            if self.factor == 1:
+                return spectral.fit_length(values, self.length)
+            return spectral.fit_length(signal.resample_poly(values, self.factor, 1, axis=-1,
+                                                            window=get_polyphase_taps(self.factor)), self.length)
+
+        columns = values.T
+        if self.kernel == 'cubic':
+            columns = self.solver.solve(np.ascontiguousarray(columns))
+        return np.asarray(self.matrix @ columns).T
+
+
+def get_interpolator(source, target, kernel='cubic'):
+    """
+    `Interpolator` for a pair of time grids and a kernel, built once per pair and kernel.
+    """
+    key = (kernel, hashlib.sha1(source.tobytes()).hexdigest(), hashlib.sha1(target.tobytes()).hexdigest())
+    if key not in interpolators:
+        interpolators[key] = Interpolator(source, target, kernel)
+    return interpolators[key]
+
+
+def interpolate_processed_signals(processed_signals, kernel='cubic'):
+    """
+    Interpolate the four processed variants of `get_processed_signals` onto `time`.
+
+    The decimated variants share the `(decimated_time, time)` grid pair and the resampled
+    ones the `(time, time)` pair, so each pair is evaluated in a single batch.
+    """
+    decimated_time = processed_signals[-1]
+    decimated = get_interpolator(decimated_time, time, kernel)(np.vstack(processed_signals[0:4:2]))
+    resampled = get_interpolator(time, time, kernel)(np.vstack(processed_signals[1:4:2]))
+    return decimated[0], resampled[0], decimated[1], resampled[1]
 
 
-def create_spectrum_animation(sig, idx=0):
-    fig, ax = plt.subplots()
+ANIMATION_FACTORS = {
+    'signal': range(2, 51),
+    'spectrum': range(2, 51),
+    'interpolation': range(2, 37),
+}
 
-    ims = []
-    for downspamling_factor in range(2, 51):
-        processed_signals = get_processed_signals(sig, downspamling_factor)
+ANIMATION_NAMES = {
+    'signal': 'Сигнал',
+    'spectrum': 'Cпектр',
+    'interpolation': 'Интерполяция',
+}
 
-        processed_signal = processed_signals[idx]
+# Processed and interpolated signals of the most recent tone, keyed by downsampling factor, mode and kernel
+processed_signals_cache = {'key': None, 'factors': {}}
+
+
+def get_processed_signals_cached(sig, downsampling_factor=5, mode='fft'):
+    """
+    Memoized `get_processed_signals` keeping the results of every factor and mode for the most recent signal.
+    """
+    key = hashlib.sha1(sig.tobytes()).hexdigest()
+    if processed_signals_cache['key'] != key:
+        processed_signals_cache['key'] = key
+        processed_signals_cache['factors'] = {}
+
+    factors = processed_signals_cache['factors']
+    if (downsampling_factor, mode) not in factors:
+        factors[downsampling_factor, mode] = get_processed_signals(sig, downsampling_factor, mode)
+    return factors[downsampling_factor, mode]
+
+
+def get_interpolated_signals_cached(sig, downsampling_factor=5, mode='fft', kernel='cubic'):
+    """
+    Memoized `interpolate_processed_signals` of the cached processed signals.
+    """
+    processed_signals = get_processed_signals_cached(sig, downsampling_factor, mode)
+    factors = processed_signals_cache['factors']
+    if (downsampling_factor, mode, kernel) not in factors:
+        factors[downsampling_factor, mode, kernel] = interpolate_processed_signals(processed_signals, kernel)
+    return factors[downsampling_factor, mode, kernel]
+
+
+def render_frame(kind, idx, downsampling_factor, processed_signal, decimated_time):
+    """
+    Draw one animation frame with the Agg backend and return it as a palette image.
+
+    Runs in the worker processes of `create_animations`; every worker reuses a single figure.
+    Interpolation frames receive the signal already interpolated onto `time`.
+    """
+    fig, (ax,) = plotting.get_figure('animation_frame', figsize=(6.4, 4.8), dpi=100)
+
+    if kind == 'spectrum':
+        fr = rfftfreq(len(decimated_time), 1. * downsampling_factor / Fs)
+        x, y = 2 * fr, abs(spectral.fft(processed_signal, buffer='spectrum'))
+        title = f"Спектр, {titles[idx]}, коэф. выброса значений {downsampling_factor}, xlim={max(2 * fr)}"
+    elif kind == 'interpolation':
+        x, y = decimated_time, processed_signal
+        title = f"Инерполяция, {titles[idx]}, коэф. выброса значений {downsampling_factor}"
+    else:
+        x, y = decimated_time, processed_signal
+        title = f"{titles[idx]}, коэф. выброса значений {downsampling_factor}"
+
+    ax.set_autoscale_on(True)
+    (plotting.plot if kind == 'spectrum' else plotting.plot_envelope)(ax, x, y)
+    if kind == 'spectrum':
+        ax.set_xlim([0, max(x)])
+    if kind == 'interpolation':
+        ax.set_ylim([-3, 3])
+    ax.set_title(title)
 
-        decimated_time = time if idx % 2 else processed_signals[-1]
+    fig.canvas.draw()
+    return Image.frombuffer('RGBA', fig.canvas.get_width_height(), fig.canvas.buffer_rgba()).convert('RGB').quantize()
 
-        fr = rfftfreq(len(decimated_time), 1. * downspamling_factor / Fs)
-        spectrum = abs(fft(processed_signal))
 
-        ax.set_xlim([0, max(2 * fr)])
-        im, = ax.plot(2 * fr, spectrum)
+def render_frame_job(job):
+    return render_frame(*job)
 
-        title = ax.text(0.5, 1.05,
-                        f"Спектр, {titles[idx]}, коэф. выброса значений {downspamling_factor}, xlim={max(2 * fr)}",
-                        size=plt.rcParams["axes.titlesize"],
-                        ha="center", transform=ax.transAxes, )
-        ims.append([im, title])
 
-    ani = animation.ArtistAnimation(fig, ims)
+def save_gif(frames, path, fps=2.5):
+    """
+    Write `frames` to a GIF with Pillow.
 
-    animation_name = f'{idx} анимация - Cпектр, {titles[idx]}'
-    ani.save(f'./animation/{animation_name}.gif', writer='imagemagick', fps=2.5, dpi=100)
-    print(f'{animation_name} создана')
-    plt.show()
+    Pillow collects every frame before encoding the file, so the whole animation is held in
+    memory at once; frames quantized to a palette take one byte per pixel.
+    """
+    frames = iter(frames)
+    first = next(frames)
+    first.save(path, save_all=True, append_images=frames, duration=int(1000 / fps), loop=0)
 
 
-def create_interpolation_animation(sig, idx=0):
-    fig, ax = plt.subplots()
+def create_animations(sig, kinds=('signal', 'spectrum', 'interpolation'), indices=range(0, 4), workers=None,
+                      directory='./animation', mode='fft', kernel='cubic'):
+    """
+    Render the GIF animations of every processed signal variant of a tone.
 
-    ims = []
-    for downspamling_factor in range(2, 37):
-        processed_signals = get_processed_signals(sig, downspamling_factor)
+    Decimation, resampling and interpolation with the `Interpolator` `kernel` run once per
+    factor and are shared by all animations, frames are rendered across a process pool and
+    written with Pillow.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=plotting.set_headless) as executor:
+        for kind in kinds:
+            for idx in indices:
+                jobs = []
+                for downsampling_factor in ANIMATION_FACTORS[kind]:
+                    if kind == 'interpolation':
+                        processed_signals = get_interpolated_signals_cached(sig, downsampling_factor, mode, kernel)
+                        decimated_time = time
+                    else:
+                        processed_signals = get_processed_signals_cached(sig, downsampling_factor, mode)
+                        decimated_time = time if idx % 2 else processed_signals[-1]
+                    jobs.append((kind, idx, downsampling_factor, processed_signals[idx], decimated_time))
 
-        processed_signal = processed_signals[idx]
+                animation_name = f'{idx} анимация - {ANIMATION_NAMES[kind]}, {titles[idx]}'
+                save_gif(executor.map(render_frame_job, jobs, chunksize=4), f'{directory}/{animation_name}.gif')
+                print(f'{animation_name} создана')
 
-        decimated_time = time if idx % 2 else processed_signals[-1]
 
-        tck = interpolate.splrep(decimated_time, processed_signal)
-        interpolated = interpolate.splev(time, tck)
+def create_animation(sig, idx=0):
+    create_animations(sig, ('signal',), [idx])
 
-        ax.set_ylim([-3, 3])
-        im, = ax.plot(time, interpolated)
 
-        title = ax.text(0.5, 1.05, f"Инерполяция, {titles[idx]}, коэф. выброса значений {downspamling_factor}",
-                        size=plt.rcParams["axes.titlesize"],
-                        ha="center", transform=ax.transAxes, )
-        ims.append([im, title])
+def create_spectrum_animation(sig, idx=0):
+    create_animations(sig, ('spectrum',), [idx])
 
-    ani = animation.ArtistAnimation(fig, ims)
 
-    animation_name = f'{idx} анимация - Интерполяция, {titles[idx]}'
-    ani.save(f'./animation/{animation_name}.gif', writer='imagemagick', fps=2.5, dpi=100)
-    print(f'{animation_name} создана')
-    plt.show()
+def create_interpolation_animation(sig, idx=0):
+    create_animations(sig, ('interpolation',), [idx])
+
+
+def create_animations_legacy(sig, kinds=('signal', 'spectrum', 'interpolation'), directory='./animation'):
+    """
+    Previous pipeline kept for `benchmark_animations`: processing is redone for every
+    animation and all frames are kept as Artists until `ArtistAnimation` is saved.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for kind in kinds:
+        for idx in range(0, 4):
+            plotting.apply_rc()
+            fig, ax = plt.subplots()
+            ims = []
+            for downsampling_factor in ANIMATION_FACTORS[kind]:
+                processed_signals = get_processed_signals(sig, downsampling_factor)
+                decimated_time = time if idx % 2 else processed_signals[-1]
+                if kind == 'spectrum':
+                    fr = rfftfreq(len(decimated_time), 1. * downsampling_factor / Fs)
+                    im, = ax.plot(2 * fr, abs(spectral.fft(processed_signals[idx])))
+                elif kind == 'interpolation':
+                    tck = interpolate.splrep(decimated_time, processed_signals[idx])
+                    im, = ax.plot(time, interpolate.splev(time, tck))
+                else:
+                    im, = ax.plot(decimated_time, processed_signals[idx])
+                ims.append([im])
+
+            ani = animation.ArtistAnimation(fig, ims)
+            ani.save(f'{directory}/legacy {kind} {idx}.gif', writer='pillow', fps=2.5, dpi=100)
+            plt.close(fig)
+
+
+def measure(function, *args, **kwargs):
+    # Unix only, imported here so that task7 itself imports everywhere
+    import resource
+
+    start = timer()
+    function(*args, **kwargs)
+    elapsed = timer() - start
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return elapsed, peak_rss
+
+
+def benchmark_animations(tone='5', directory='./animation/benchmark'):
+    """
+    Compare wall time and peak RSS (KiB, largest process) of the legacy and current animation pipelines for one tone.
+
+    Each pipeline runs in a fresh process so the peaks do not mix. Frames of the pool pipeline
+    are not written incrementally: Pillow has no GIF writer taking frames one at a time, so
+    each animation is held as palette images until it is saved, which the output states.
+    """
+    sig, _ = generate_signal(DTMF_TABLE[tone])
+    for name, function in (('legacy', create_animations_legacy), ('pool', create_animations)):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            elapsed, peak_rss = executor.submit(measure, function, sig, directory=directory).result()
+        print(f'{name}: {elapsed:.1f} s, peak RSS {peak_rss} KiB')
+    print('pool: frames rendered in parallel, each GIF written once all its frames are rendered '
+          '(held as palette images, not written incrementally)')
+
+
+def aliasing_error(sig, resampled_sig, downsampling_factor):
+    """
+    RMS difference between a resampled signal and the ideal band-limited `sig` at the reduced Nyquist frequency.
+    """
+    spectrum = np.fft.rfft(sig)
+    spectrum[np.fft.rfftfreq(len(sig), 1. / Fs) >= Fs / (2 * downsampling_factor)] = 0
+    ideal = np.fft.irfft(spectrum, len(sig))
+    return np.sqrt(np.mean((resampled_sig - ideal) ** 2))
+
+
+def benchmark_resampling(tone='5', factors=(2, 5, 10, 20, 50), modes=('fft', 'polyphase')):
+    """
+    Compare time, peak traced memory and aliasing error of the resampling modes for one tone.
+    """
+    sig, _ = generate_signal(DTMF_TABLE[tone])
+    print('mode,ftype,factor,ms,peak_kib,rms_error')
+    for mode in modes:
+        for downsampling_factor in factors:
+            for ftype, N in (('fir', 21), ('iir', 1)):
+                tracemalloc.start()
+                start = timer()
+                _, resampled_sig = process_signals(sig, downsampling_factor, N, ftype, mode)
+                elapsed = timer() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                error = aliasing_error(sig, resampled_sig, downsampling_factor)
+                print(f'{mode},{ftype},{downsampling_factor},{elapsed * 1e3:.2f},{peak // 1024},{error:.4f}')
+
+
+def benchmark_cascade(tone='5', factors=(8, 20, 50, 100), repeat=5):
+    """
+    Compare a single-stage polyphase decimator with the planned cascade of the same specification.
+    """
+    sig, _ = generate_signal(DTMF_TABLE[tone])
+    print('factor,stages,ops_per_sample,single_stage_ops,ms,single_stage_ms')
+    for downsampling_factor in factors:
+        plan = plan_decimation(downsampling_factor)
+        single_taps = design_decimation_stages((downsampling_factor,))[0]
+
+        timings = []
+        for run in (lambda: decimate_cascade(sig, downsampling_factor),
+                    lambda: signal.resample_poly(sig, 1, downsampling_factor, window=single_taps)):
+            start = timer()
+            for _ in range(repeat):
+                run()
+            timings.append((timer() - start) / repeat)
+
+        stages = 'x'.join(map(str, plan.factors))
+        print(f'{downsampling_factor},{stages},{plan.ops_per_sample},{len(single_taps)},'
+              f'{timings[0] * 1e3:.2f},{timings[1] * 1e3:.2f}')
+
+
+def benchmark_interpolation(tone='5', factors=(2, 5, 10, 20, 36), kernels=Interpolator.kernels, repeat=5):
+    """
+    Compare the `Interpolator` kernels with per-variant `splrep`/`splev` on the four processed variants.
+
+    `build_ms` is the one-off cost of the grid structures, `ms` the batched evaluation and
+    `max_error` the largest deviation from the `splrep` result inside the decimated time
+    range, where the spline does not extrapolate.
+    """
+    sig, _ = generate_signal(DTMF_TABLE[tone])
+    print('kernel,factor,build_ms,ms,splrep_ms,max_error')
+    for downsampling_factor in factors:
+        processed_signals = get_processed_signals(sig, downsampling_factor)
+        decimated_time = processed_signals[-1]
+        inside = (time >= decimated_time[0]) & (time <= decimated_time[-1])
+
+        start = timer()
+        for _ in range(repeat):
+            reference = [interpolate.splev(time, interpolate.splrep(time if idx % 2 else decimated_time,
+                                                                    processed_signals[idx]))
+                         for idx in range(0, 4)]
+        splrep_elapsed = (timer() - start) / repeat
+
+        for kernel in kernels:
+            interpolators.clear()
+            start = timer()
+            interpolate_processed_signals(processed_signals, kernel)
+            build_elapsed = timer() - start
+
+            start = timer()
+            for _ in range(repeat):
+                interpolated = interpolate_processed_signals(processed_signals, kernel)
+            elapsed = (timer() - start) / repeat
+
+            error = np.abs(np.asarray(interpolated) - reference)[:, inside].max()
+            print(f'{kernel},{downsampling_factor},{(build_elapsed - elapsed) * 1e3:.2f},{elapsed * 1e3:.2f},'
+                  f'{splrep_elapsed * 1e3:.2f},{error:.2e}')
 
 
 def process_and_display_signals(sig, downsampling_factor, five_periods, tone):
@@ -263,24 +652,29 @@ def process_and_display_signals(sig, downsampling_factor, five_periods, tone):
 
 
 def callback(tone):
-    freqs = DTMF_TABLE[int(tone)]
+    freqs = DTMF_TABLE[tone.upper()]
     sig, five_periods = generate_signal(freqs)
     draw_signal_and_spectrum(time, sig, five_periods, title=tone)
 
     [process_and_display_signals(sig, downsampling_factor, five_periods, tone) for downsampling_factor in
      list([2, 20, 50])]
 
-    [create_animation(sig, idx) for idx in range(0, 4)]
-    [create_spectrum_animation(sig, idx) for idx in range(0, 4)]
-    [create_interpolation_animation(sig, idx) for idx in range(0, 4)]
+    create_animations(sig)
 
 
 def main():
-    print('Введите тона:')
-    tones = list(input())
-    list(map(callback, tones))
-
+    while True:
+        print('Введите тона:')
+        try:
+            tones = list(input())
+        except EOFError:
+            return
+        list(map(callback, tones))
+
+
+if __name__ == '__main__':
+    # benchmark_animations()
+    # benchmark_resampling()
+    # benchmark_cascade()
+    # benchmark_interpolation()
     main()
-
-
-main()